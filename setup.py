@@ -11,6 +11,7 @@ setup(
         'cloud-sql-python-connector==1.13.0',
         'python-dotenv==1.0.0',
         'pydantic==2.5.3',
+        'numpy>=1.24',
     ],
     entry_points={
         'console_scripts': [
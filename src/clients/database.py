@@ -2,17 +2,28 @@
 Database connection and session management using SQLAlchemy
 """
 import os
+import time
+import threading
+from functools import partial
 from dotenv import load_dotenv
 import logging
 from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker, scoped_session, declarative_base
-from sqlalchemy.pool import NullPool
+from sqlalchemy.pool import NullPool, QueuePool
 from google.cloud.sql.connector import Connector, IPTypes
+from src.telemetry.metrics import REGISTRY
 
 load_dotenv()
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+POOL_WAIT_SECONDS = REGISTRY.histogram(
+    "db_pool_wait_seconds", "Time checkouts blocked waiting for a free pooled connection"
+)
+CONNECT_SECONDS = REGISTRY.histogram(
+    "db_connect_seconds", "Time to open a new database connection, including the TLS handshake"
+)
+POOL_CONNECTIONS = REGISTRY.gauge("db_pool_connections", "Pooled database connections", labels=("state",))
+
 # SQLAlchemy components
 Base = declarative_base()
 engine = None
@@ -35,6 +46,132 @@ def getconn():
     )
     return conn
 
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool that records checkout waits and connection opening separately
+
+    A checkout counts as a wait only when every connection, overflow
+    included, is in use and the caller blocks for one to be returned.
+    Opening a connection (with its TLS handshake) is timed on its own.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.checkout_count = 0
+        self.wait_count = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.connect_count = 0
+        self.connect_time_total = 0.0
+        self._stats_lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def _do_get(self):
+        # The condition under which QueuePool blocks on its queue instead of opening an overflow connection
+        must_wait = self._max_overflow > -1 and self._overflow >= self._max_overflow and self._pool.empty()
+        if not must_wait:
+            with self._stats_lock:
+                self.checkout_count += 1
+            return super()._do_get()
+
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - started
+            POOL_WAIT_SECONDS.observe(waited)
+            with self._stats_lock:
+                self.checkout_count += 1
+                self.wait_count += 1
+                self.wait_time_total += waited
+                self.wait_time_max = max(self.wait_time_max, waited)
+
+    def _should_wrap_creator(self, creator):
+        invoke = super()._should_wrap_creator(creator)
+
+        def timed_invoke(record):
+            started = time.perf_counter()
+            try:
+                return invoke(record)
+            finally:
+                elapsed = time.perf_counter() - started
+                CONNECT_SECONDS.observe(elapsed)
+                with self._stats_lock:
+                    self.connect_count += 1
+                    self.connect_time_total += elapsed
+        return timed_invoke
+
+
+def _pool_gauge(method: str) -> float:
+    pool = engine.pool if engine is not None else None
+    return getattr(pool, method)() if isinstance(pool, QueuePool) else 0
+
+
+POOL_CONNECTIONS.labels("checked_out").set_function(partial(_pool_gauge, "checkedout"))
+POOL_CONNECTIONS.labels("idle").set_function(partial(_pool_gauge, "checkedin"))
+POOL_CONNECTIONS.labels("overflow").set_function(partial(_pool_gauge, "overflow"))
+
+
+def _pool_options():
+    """
+    Engine pool settings from the environment
+
+    DB_POOL_MODE=queue (default) keeps connections open between units of work,
+    DB_POOL_MODE=null opens a new connection (and TLS handshake) every time.
+    """
+    mode = os.getenv("DB_POOL_MODE", "queue").lower()
+    if mode == "null":
+        return {"poolclass": NullPool}
+    if mode != "queue":
+        raise ValueError(f"Unknown DB_POOL_MODE '{mode}', expected 'queue' or 'null'")
+    return {
+        "poolclass": TimedQueuePool,
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "5")),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() == "true",
+    }
+
+def warm_up_pool(connections: int):
+    """Open `connections` pooled connections up front so first requests skip connect latency"""
+    if engine is None or connections <= 0:
+        return
+    opened = []
+    try:
+        for _ in range(connections):
+            opened.append(engine.connect())
+    except Exception as e:
+        logger.warning(f"Pool warm-up stopped after {len(opened)} connections: {e}")
+    finally:
+        for conn in opened:
+            conn.close()
+    logger.info(f"Pool warmed up with {len(opened)} connections")
+
+def pool_stats() -> dict:
+    """Current connection pool counters (empty if not connected)"""
+    if engine is None:
+        return {}
+    pool = engine.pool
+    if not isinstance(pool, QueuePool):
+        return {"pool": type(pool).__name__}
+    stats = {
+        "pool": type(pool).__name__,
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": pool.overflow(),
+    }
+    if isinstance(pool, TimedQueuePool):
+        stats.update({
+            "checkouts": pool.checkout_count,
+            "waits": pool.wait_count,
+            "wait_time_total": round(pool.wait_time_total, 4),
+            "wait_time_max": round(pool.wait_time_max, 4),
+            "connects": pool.connect_count,
+            "connect_time_total": round(pool.connect_time_total, 4),
+        })
+    return stats
+
 def connect_db():
     """Initialize SQLAlchemy engine and session factory"""
     global engine, Session
@@ -51,8 +188,8 @@ def connect_db():
             )
             engine = create_engine(
                 connection_string,
-                poolclass=NullPool,
-                echo=False
+                echo=False,
+                **_pool_options()
             )
         else:
             # Cloud SQL Connector (for public IP)
@@ -60,8 +197,8 @@ def connect_db():
             engine = create_engine(
                 "postgresql+pg8000://",
                 creator=getconn,
-                poolclass=NullPool,
-                echo=False
+                echo=False,
+                **_pool_options()
             )
         
         # Test connection
@@ -70,6 +207,7 @@ def connect_db():
         
         # Create session factory
         Session = scoped_session(sessionmaker(bind=engine))
+        warm_up_pool(int(os.getenv("DB_POOL_WARMUP", "0")))
         
         print("CLOUD SQL CONNECTED SUCCESSFULLY!")
         logger.info("Cloud SQL ready")
@@ -2,10 +2,16 @@
 Google Pub/Sub Configuration for Matchmaking System
 """
 import os
+import re
+from typing import List, Optional
 from dotenv import load_dotenv
+from src.models.user_model import Region
 
 load_dotenv()
 
+PARTITION_ATTRIBUTE = "partition"
+PARTITION_MODES = ("", "region", "region_mmr")
+
 
 class PubSubConfig:
     """Configuration for Google Pub/Sub"""
@@ -15,6 +21,90 @@ class PubSubConfig:
         self.topic_id = os.getenv("PUBSUB_TOPIC_ID", "matchmaking-queue")
         self.subscription_id = os.getenv("PUBSUB_SUBSCRIPTION_ID", "matchmaking-subscription")
 
+        # Payload encoding for published tickets: "json", "bin1" (compact binary) or
+        # "thin1" (user_id and profile version only, the consumer looks the profile up).
+        # Consumers read the encoding from the message attribute, so they can be mixed.
+        self.message_encoding = os.getenv("PUBSUB_MESSAGE_ENCODING", "json")
+
+        # Publisher batching and flow control (used by the non-blocking publish path)
+        self.batch_max_messages = int(os.getenv("PUBSUB_BATCH_MAX_MESSAGES", "100"))
+        self.batch_max_bytes = int(os.getenv("PUBSUB_BATCH_MAX_BYTES", str(1024 * 1024)))
+        self.batch_max_latency = float(os.getenv("PUBSUB_BATCH_MAX_LATENCY", "0.01"))
+        self.publish_max_outstanding_messages = int(os.getenv("PUBSUB_PUBLISH_MAX_OUTSTANDING_MESSAGES", "1000"))
+        self.publish_max_outstanding_bytes = int(os.getenv("PUBSUB_PUBLISH_MAX_OUTSTANDING_BYTES", str(10 * 1024 * 1024)))
+
+        # Subscriber flow control: messages leased but not yet acked (client defaults).
+        # With adaptive flow control these are the upper limits, and a change is only
+        # applied by resubscribing when it exceeds the threshold (a fraction of the limit).
+        self.flow_max_messages = int(os.getenv("PUBSUB_FLOW_MAX_MESSAGES", "1000"))
+        self.flow_max_bytes = int(os.getenv("PUBSUB_FLOW_MAX_BYTES", str(100 * 1024 * 1024)))
+        self.flow_resubscribe_threshold = float(os.getenv("PUBSUB_FLOW_RESUBSCRIBE_THRESHOLD", "0.25"))
+        self.flow_resubscribe_interval = float(os.getenv("PUBSUB_FLOW_RESUBSCRIBE_INTERVAL", "10"))
+
+        # Partitioning: the publisher tags every ticket with a partition attribute, "America"
+        # by region or "America/2" by region and MMR band (2000-2999 with 1000-wide bands).
+        # A consumer given PUBSUB_PARTITIONS reads its own filtered subscription of just those
+        # partitions ("America/2" exactly, or "America" for all of a region's bands), so
+        # instances can be added per partition without splitting a pool between them.
+        # PUBSUB_ORDERING also uses the partition as ordering key (the subscription must
+        # have message ordering enabled, and callbacks of one key then run one at a time).
+        self.partition_by = os.getenv("PUBSUB_PARTITION_BY", "")
+        if self.partition_by not in PARTITION_MODES:
+            raise ValueError(f"Unknown PUBSUB_PARTITION_BY '{self.partition_by}', expected one of {PARTITION_MODES[1:]}")
+        self.partition_mmr_band = int(os.getenv("PUBSUB_PARTITION_MMR_BAND", "1000"))
+        self.ordering = os.getenv("PUBSUB_ORDERING", "false").lower() == "true"
+        self.base_subscription_id = self.subscription_id
+        self.partitions: List[str] = []
+        self.set_partitions([p.strip() for p in os.getenv("PUBSUB_PARTITIONS", "").split(",") if p.strip()])
+
+    def set_partitions(self, partitions: List[str]):
+        """Own `partitions`, which also selects the subscription named after them"""
+        if partitions and not self.partition_by:
+            raise ValueError("PUBSUB_PARTITIONS needs PUBSUB_PARTITION_BY")
+        for partition in partitions:
+            self._validate_partition(partition)
+        self.partitions = list(partitions)
+        if partitions:
+            slug = "-".join(re.sub(r"[^a-z0-9]+", "-", p.lower()).strip("-") for p in partitions)
+            self.subscription_id = f"{self.base_subscription_id}-{slug}"
+        else:
+            self.subscription_id = self.base_subscription_id
+
+    def _validate_partition(self, partition: str):
+        """Reject partition names the publisher never produces, their subscription filter would match nothing"""
+        region, _, band = partition.partition("/")
+        if region not in {r.value for r in Region}:
+            raise ValueError(f"Unknown region in partition '{partition}'")
+        if band and self.partition_by == "region":
+            raise ValueError(f"Partition '{partition}' has an MMR band, but PUBSUB_PARTITION_BY is 'region'")
+        if band and not band.isdigit():
+            raise ValueError(f"MMR band of partition '{partition}' must be a non-negative integer")
+
+    def partition_key(self, region: str, mmr: int) -> str:
+        """Partition of a ticket, empty when partitioning is off"""
+        region = getattr(region, "value", region)
+        if self.partition_by == "region":
+            return region
+        if self.partition_by == "region_mmr":
+            return f"{region}/{mmr // self.partition_mmr_band}"
+        return ""
+
+    def owns(self, partition: Optional[str]) -> bool:
+        """Whether this consumer's partitions include `partition` (everything when none are set)"""
+        if not self.partitions or not partition:
+            return True
+        return any(partition == p or partition.startswith(f"{p}/") for p in self.partitions)
+
+    def subscription_filter(self) -> str:
+        """Pub/Sub filter expression selecting this consumer's partitions"""
+        clauses = []
+        for partition in self.partitions:
+            if self.partition_by == "region_mmr" and "/" not in partition:
+                clauses.append(f'hasPrefix(attributes.{PARTITION_ATTRIBUTE}, "{partition}/")')
+            else:
+                clauses.append(f'attributes.{PARTITION_ATTRIBUTE} = "{partition}"')
+        return " OR ".join(clauses)
+
     @classmethod
     def from_env(cls):
         return cls()
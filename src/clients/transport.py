@@ -0,0 +1,538 @@
+"""
+Message Transport for the Matchmaking Queue
+Pub/Sub and in-process implementations behind one publish/subscribe interface
+"""
+import os
+import time
+import queue
+import uuid
+import logging
+import threading
+from collections import deque
+from concurrent import futures
+from functools import partial
+from datetime import datetime, timezone
+from typing import Callable, Deque, Dict, List, Optional, Protocol, Tuple
+from google.api_core import exceptions
+from google.cloud import pubsub_v1
+from google.cloud.pubsub_v1.subscriber.scheduler import ThreadScheduler
+from src.clients.pubsub_config import PARTITION_ATTRIBUTE, PubSubConfig
+
+logger = logging.getLogger(__name__)
+
+TRANSPORTS = ("pubsub", "memory")
+
+
+class Message(Protocol):
+    """What subscriber callbacks receive, satisfied by Pub/Sub's Message"""
+    message_id: str
+    data: bytes
+    attributes: Dict[str, str]
+    delivery_attempt: Optional[int]
+
+    def ack(self) -> None: ...
+
+    def nack(self) -> None: ...
+
+
+# Set on a message when the transport hands it to the callback executor
+DELIVERED_AT = "delivered_at"
+
+
+def stamp_delivery(message: Message) -> Message:
+    """Record the hand-over time, so latency includes the wait for an executor thread"""
+    setattr(message, DELIVERED_AT, time.perf_counter())
+    return message
+
+
+def delivered_at(message: Message) -> Optional[float]:
+    """perf_counter() time the transport handed the message over, None if it was not stamped"""
+    return getattr(message, DELIVERED_AT, None)
+
+
+class Transport:
+    """
+    Publish/subscribe on the matchmaking topic
+
+    publish() returns a future resolving to the message id. subscribe()
+    runs `callback` on `executor` for every delivered message and returns
+    a future that completes when the subscription is cancelled. Messages
+    that are nacked, or still outstanding when the subscriber goes away,
+    are delivered again.
+    """
+
+    name = "transport"
+
+    def connect_publisher(self):
+        raise NotImplementedError
+
+    def publish(self, data: bytes, ordering_key: str = "", **attributes: str) -> futures.Future:
+        raise NotImplementedError
+
+    def subscribe(self, callback: Callable[[Message], None], executor: futures.Executor) -> futures.Future:
+        raise NotImplementedError
+
+    def set_flow_control(self, max_messages: int, max_bytes: int) -> bool:
+        """Change how many messages may be outstanding, returns True if the new limits were applied"""
+        return False
+
+    def close(self):
+        raise NotImplementedError
+
+
+class SharedExecutorScheduler(ThreadScheduler):
+    """
+    ThreadScheduler that leaves the executor running when its stream shuts down
+
+    The stock scheduler shuts the executor down with the stream, this one
+    only drops the callbacks still queued (the client nacks them) so the
+    consumer's executor can serve the next streaming pull after a resubscribe.
+    Messages are stamped with their delivery time on the way in.
+    """
+
+    def schedule(self, callback: Callable, *args, **kwargs) -> None:
+        if args:
+            stamp_delivery(args[0])
+        super().schedule(callback, *args, **kwargs)
+
+    def shutdown(self, await_msg_callbacks: bool = False) -> List[Message]:
+        dropped = []
+        try:
+            while True:
+                work_item = self._executor._work_queue.get(block=False)
+                if work_item is not None:
+                    dropped.append(work_item.args[0])
+        except queue.Empty:
+            pass
+        return dropped
+
+
+class ResubscribingPull(futures.Future):
+    """
+    Streaming pull that can be restarted with new flow control limits
+
+    Stays pending across resubscribes and completes like Pub/Sub's
+    StreamingPullFuture: when cancelled, or when the current stream fails.
+    Acks of messages delivered by the replaced stream are lost once it is
+    closed, those messages are redelivered after their ack deadline.
+    """
+
+    def __init__(self, open_stream: Callable[[int, int], futures.Future], max_messages: int, max_bytes: int):
+        super().__init__()
+        self._open_stream = open_stream
+        self._lock = threading.Lock()
+        self._stream: Optional[futures.Future] = None
+        self._cancelled = False
+        self._open(max_messages, max_bytes)
+
+    def resubscribe(self, max_messages: int, max_bytes: int):
+        with self._lock:
+            if self._cancelled or self.done():
+                return
+            stream, self._stream = self._stream, None
+            stream.cancel()
+            try:
+                # Wait for the old stream to close so both never pull at once
+                stream.result(timeout=30)
+            except Exception as e:
+                logger.warning(f"Replaced streaming pull ended with: {e}")
+            self._open(max_messages, max_bytes)
+
+    def cancel(self) -> bool:
+        with self._lock:
+            self._cancelled = True
+            stream, self._stream = self._stream, None
+        if stream is not None:
+            stream.cancel()
+            try:
+                stream.result()
+            except Exception as e:
+                logger.warning(f"Streaming pull ended with: {e}")
+        if not self.done():
+            self.set_result(None)
+        return True
+
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def _open(self, max_messages: int, max_bytes: int):
+        stream = self._open_stream(max_messages, max_bytes)
+        self._stream = stream
+        stream.add_done_callback(self._on_stream_done)
+
+    def _on_stream_done(self, stream: futures.Future):
+        # A stream replaced by resubscribe() or cancel() is no longer current
+        if stream is not self._stream or self.done():
+            return
+        error = stream.exception()
+        if error is not None:
+            self.set_exception(error)
+        else:
+            self.set_result(None)
+
+
+class PubSubTransport(Transport):
+    """Google Pub/Sub topic and subscription from PubSubConfig"""
+
+    name = "pubsub"
+
+    def __init__(self, config: Optional[PubSubConfig] = None):
+        self.config = config or PubSubConfig.from_env()
+        self.publisher: Optional[pubsub_v1.PublisherClient] = None
+        self.subscriber: Optional[pubsub_v1.SubscriberClient] = None
+        self.topic_path: Optional[str] = None
+        self.subscription_path: Optional[str] = None
+        self.pull: Optional[ResubscribingPull] = None
+        self.max_messages = self.config.flow_max_messages
+        self.max_bytes = self.config.flow_max_bytes
+        self._resubscribed_at = 0.0
+
+    def connect_publisher(self):
+        batch_settings = pubsub_v1.types.BatchSettings(
+            max_messages=self.config.batch_max_messages,
+            max_bytes=self.config.batch_max_bytes,
+            max_latency=self.config.batch_max_latency,
+        )
+        publisher_options = pubsub_v1.types.PublisherOptions(
+            enable_message_ordering=self.config.ordering,
+            flow_control=pubsub_v1.types.PublishFlowControl(
+                message_limit=self.config.publish_max_outstanding_messages,
+                byte_limit=self.config.publish_max_outstanding_bytes,
+                limit_exceeded_behavior=pubsub_v1.types.LimitExceededBehavior.BLOCK,
+            )
+        )
+        self.publisher = pubsub_v1.PublisherClient(batch_settings, publisher_options=publisher_options)
+        self.topic_path = self.publisher.topic_path(self.config.project_id, self.config.topic_id)
+
+    def publish(self, data: bytes, ordering_key: str = "", **attributes: str) -> futures.Future:
+        if not ordering_key or not self.config.ordering:
+            return self.publisher.publish(self.topic_path, data, **attributes)
+        future = self.publisher.publish(self.topic_path, data, ordering_key=ordering_key, **attributes)
+        future.add_done_callback(partial(self._resume_on_error, ordering_key))
+        return future
+
+    def _resume_on_error(self, ordering_key: str, future: futures.Future):
+        # A failed publish pauses its ordering key until resumed
+        if future.exception() is not None and self.publisher is not None:
+            self.publisher.resume_publish(self.topic_path, ordering_key)
+
+    def subscribe(self, callback: Callable[[Message], None], executor: futures.Executor) -> futures.Future:
+        self.subscriber = pubsub_v1.SubscriberClient()
+        self.subscription_path = self.subscriber.subscription_path(
+            self.config.project_id, self.config.subscription_id
+        )
+        if self.config.partitions:
+            self._ensure_partition_subscription()
+
+        def open_stream(max_messages: int, max_bytes: int) -> futures.Future:
+            # The executor runs the callbacks instead of the client's default pool
+            return self.subscriber.subscribe(
+                self.subscription_path,
+                callback=callback,
+                flow_control=pubsub_v1.types.FlowControl(max_messages=max_messages, max_bytes=max_bytes),
+                scheduler=SharedExecutorScheduler(executor=executor),
+            )
+
+        self.pull = ResubscribingPull(open_stream, self.max_messages, self.max_bytes)
+        self._resubscribed_at = time.monotonic()
+        return self.pull
+
+    def _ensure_partition_subscription(self):
+        """Create the filtered subscription of this consumer's partitions if it does not exist yet"""
+        expected = self.config.subscription_filter()
+        try:
+            existing = self.subscriber.get_subscription(request={"subscription": self.subscription_path})
+        except exceptions.NotFound:
+            topic_path = self.subscriber.topic_path(self.config.project_id, self.config.topic_id)
+            self.subscriber.create_subscription(request={
+                "name": self.subscription_path,
+                "topic": topic_path,
+                "filter": expected,
+                "enable_message_ordering": self.config.ordering,
+                "ack_deadline_seconds": 60,
+            })
+            logger.info(f"Created subscription {self.config.subscription_id} with filter: {expected}")
+            return
+        if existing.filter != expected:
+            # Filters cannot be changed, a different partition set needs a new subscription. Every
+            # subscriber of this one would receive (and nack) the same foreign tickets, so refuse to start
+            raise ValueError(
+                f"Subscription {self.config.subscription_id} filters '{existing.filter}', "
+                f"expected '{expected}': delete it or use a different PUBSUB_SUBSCRIPTION_ID"
+            )
+
+    def set_flow_control(self, max_messages: int, max_bytes: int) -> bool:
+        """
+        Resubscribe with new limits, the client cannot change them on a live stream
+
+        Changes smaller than flow_resubscribe_threshold, or within
+        flow_resubscribe_interval seconds of the last resubscribe, are
+        skipped: every resubscribe costs a stream setup and the redelivery
+        of whatever was in flight.
+        """
+        if self.pull is None:
+            self.max_messages, self.max_bytes = max_messages, max_bytes
+            return True
+        change = abs(max_messages - self.max_messages) / max(self.max_messages, 1)
+        if change < self.config.flow_resubscribe_threshold:
+            return False
+        if time.monotonic() - self._resubscribed_at < self.config.flow_resubscribe_interval:
+            return False
+        logger.info(f"Resubscribing with flow control {self.max_messages} -> {max_messages} messages")
+        self.max_messages, self.max_bytes = max_messages, max_bytes
+        self.pull.resubscribe(max_messages, max_bytes)
+        self._resubscribed_at = time.monotonic()
+        return True
+
+    def close(self):
+        if self.publisher:
+            self.publisher.stop()
+            self.publisher = None
+        if self.subscriber:
+            self.subscriber.close()
+            self.subscriber = None
+
+
+class InMemoryMessage:
+    """A delivery of a queued message, acked or nacked at most once"""
+
+    def __init__(self, subscription: "InMemorySubscription", ack_id: int, message_id: str, data: bytes,
+                 attributes: Dict[str, str], publish_time: datetime, delivery_attempt: int):
+        self._subscription = subscription
+        self._ack_id = ack_id
+        self.message_id = message_id
+        self.data = data
+        self.attributes = attributes
+        self.publish_time = publish_time
+        self.delivery_attempt = delivery_attempt
+        self.delivered_at: Optional[float] = None
+
+    def ack(self):
+        self._subscription.ack(self._ack_id)
+
+    def nack(self):
+        self._subscription.nack(self._ack_id)
+
+
+# message_id, data, attributes, publish_time, delivery_attempt
+QueuedMessage = Tuple[str, bytes, Dict[str, str], datetime, int]
+
+
+class InMemorySubscription:
+    """
+    Queue with Pub/Sub's at-least-once delivery rules
+
+    A delivered message is leased until it is acked, nacked, or held for
+    longer than `max_lease` seconds (the Pub/Sub client extends leases for
+    the same maximum). Nacked and expired messages go back to the front of
+    the queue and are redelivered with a higher delivery_attempt; a late
+    ack of an expired lease is ignored, as it is by Pub/Sub. Subscribers on
+    the same subscription share its messages.
+    """
+
+    def __init__(self, name: str, max_outstanding: int, max_lease: float,
+                 accepts: Optional[Callable[[Dict[str, str]], bool]] = None):
+        self.name = name
+        self.max_outstanding = max_outstanding
+        self.max_lease = max_lease
+        # Subscription filter on message attributes, as set at creation in Pub/Sub
+        self.accepts = accepts
+        self._queue: Deque[QueuedMessage] = deque()
+        self._leases: Dict[int, Tuple[QueuedMessage, float, int]] = {}
+        self._next_ack_id = 0
+        self._changed = threading.Condition()
+
+    def __len__(self) -> int:
+        with self._changed:
+            return len(self._queue) + len(self._leases)
+
+    def put(self, message: QueuedMessage):
+        with self._changed:
+            self._queue.append(message)
+            self._changed.notify_all()
+
+    def ack(self, ack_id: int):
+        with self._changed:
+            if self._leases.pop(ack_id, None) is not None:
+                self._changed.notify_all()
+
+    def nack(self, ack_id: int):
+        with self._changed:
+            lease = self._leases.pop(ack_id, None)
+            if lease is not None:
+                self._queue.appendleft(lease[0])
+                self._changed.notify_all()
+
+    def release(self, owner: int):
+        """Return every message leased by a closing subscriber to the queue"""
+        with self._changed:
+            for ack_id, (message, _, lease_owner) in list(self._leases.items()):
+                if lease_owner == owner:
+                    del self._leases[ack_id]
+                    self._queue.appendleft(message)
+            self._changed.notify_all()
+
+    def lease(self, owner: int, stopped: threading.Event, timeout: float) -> list:
+        """Wait for deliverable messages and lease as many as flow control allows"""
+        with self._changed:
+            self._expire_leases()
+            if not self._queue or len(self._leases) >= self.max_outstanding:
+                self._changed.wait(timeout=timeout)
+                self._expire_leases()
+            if stopped.is_set():
+                return []
+
+            deliveries = []
+            deadline = time.monotonic() + self.max_lease
+            while self._queue and len(self._leases) < self.max_outstanding:
+                message_id, data, attributes, publish_time, attempt = self._queue.popleft()
+                redelivery = (message_id, data, attributes, publish_time, attempt + 1)
+                ack_id = self._next_ack_id
+                self._next_ack_id += 1
+                self._leases[ack_id] = (redelivery, deadline, owner)
+                deliveries.append(InMemoryMessage(self, ack_id, message_id, data, attributes, publish_time, attempt))
+            return deliveries
+
+    def wake(self):
+        with self._changed:
+            self._changed.notify_all()
+
+    def set_max_outstanding(self, max_outstanding: int):
+        with self._changed:
+            self.max_outstanding = max_outstanding
+            self._changed.notify_all()
+
+    def _expire_leases(self):
+        now = time.monotonic()
+        for ack_id, (message, deadline, _) in list(self._leases.items()):
+            if deadline <= now:
+                del self._leases[ack_id]
+                self._queue.appendleft(message)
+
+
+class InMemoryBroker:
+    """Process-wide topics and subscriptions shared by in-memory transports"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._topics: Dict[str, Dict[str, InMemorySubscription]] = {}
+
+    def subscription(self, topic: str, name: str, max_outstanding: int, max_lease: float,
+                     accepts: Optional[Callable[[Dict[str, str]], bool]] = None) -> InMemorySubscription:
+        with self._lock:
+            subscriptions = self._topics.setdefault(topic, {})
+            if name not in subscriptions:
+                subscriptions[name] = InMemorySubscription(name, max_outstanding, max_lease, accepts)
+            return subscriptions[name]
+
+    def publish(self, topic: str, message: QueuedMessage):
+        with self._lock:
+            subscriptions = list(self._topics.get(topic, {}).values())
+        attributes = message[2]
+        for subscription in subscriptions:
+            if subscription.accepts is None or subscription.accepts(attributes):
+                subscription.put(message)
+
+
+BROKER = InMemoryBroker()
+
+
+class InMemoryStreamingPull(futures.Future):
+    """Dispatcher thread feeding one subscriber, completes when cancelled like Pub/Sub's StreamingPullFuture"""
+
+    def __init__(self, subscription: InMemorySubscription, callback: Callable[[Message], None],
+                 executor: futures.Executor):
+        super().__init__()
+        self._subscription = subscription
+        self._callback = callback
+        self._executor = executor
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._dispatch, name=f"memory-pull-{subscription.name}", daemon=True)
+        self._thread.start()
+
+    def cancel(self) -> bool:
+        if self._stopped.is_set():
+            return False
+        self._stopped.set()
+        self._subscription.wake()
+        self._thread.join()
+        self._subscription.release(id(self))
+        if not self.done():
+            self.set_result(None)
+        return True
+
+    def _dispatch(self):
+        while not self._stopped.is_set():
+            for message in self._subscription.lease(id(self), self._stopped, timeout=1.0):
+                try:
+                    self._executor.submit(self._callback, stamp_delivery(message))
+                except RuntimeError:
+                    # Executor shut down under us, the lease is released on cancel
+                    break
+
+
+class InMemoryTransport(Transport):
+    """
+    In-process topic with Pub/Sub's ack/nack and redelivery semantics
+
+    Publisher and consumer must run in the same process and share the
+    module-level broker. The subscription named in the config is created
+    as soon as either side builds its transport, so messages published
+    before the consumer subscribes are kept, as with a pre-created Pub/Sub
+    subscription.
+    """
+
+    name = "memory"
+
+    def __init__(self, config: Optional[PubSubConfig] = None, broker: Optional[InMemoryBroker] = None):
+        self.config = config or PubSubConfig.from_env()
+        self.broker = broker or BROKER
+        self.subscription = self.broker.subscription(
+            self.config.topic_id,
+            self.config.subscription_id,
+            max_outstanding=int(os.getenv("MEMORY_TRANSPORT_MAX_OUTSTANDING", "1000")),
+            max_lease=float(os.getenv("MEMORY_TRANSPORT_MAX_LEASE", "3600")),
+            accepts=self._accepts if self.config.partitions else None,
+        )
+        self._pulls = []
+
+    def connect_publisher(self):
+        pass
+
+    def _accepts(self, attributes: Dict[str, str]) -> bool:
+        # Like a Pub/Sub filter, a message without the attribute matches no partition
+        partition = attributes.get(PARTITION_ATTRIBUTE)
+        return partition is not None and self.config.owns(partition)
+
+    def publish(self, data: bytes, ordering_key: str = "", **attributes: str) -> futures.Future:
+        # Delivery is FIFO per subscription already, ordering keys need no handling here
+        message_id = uuid.uuid4().hex
+        self.broker.publish(self.config.topic_id, (message_id, data, dict(attributes), datetime.now(timezone.utc), 1))
+        future = futures.Future()
+        future.set_result(message_id)
+        return future
+
+    def subscribe(self, callback: Callable[[Message], None], executor: futures.Executor) -> futures.Future:
+        pull = InMemoryStreamingPull(self.subscription, callback, executor)
+        self._pulls.append(pull)
+        return pull
+
+    def set_flow_control(self, max_messages: int, max_bytes: int) -> bool:
+        """Applied to the live subscription; messages are not sized, so only the count is limited"""
+        self.subscription.set_max_outstanding(max_messages)
+        return True
+
+    def close(self):
+        for pull in self._pulls:
+            pull.cancel()
+        self._pulls = []
+
+
+def create_transport(kind: Optional[str] = None, config: Optional[PubSubConfig] = None) -> Transport:
+    """Build the transport named by `kind` or MATCHMAKING_TRANSPORT (default "pubsub")"""
+    kind = kind or os.getenv("MATCHMAKING_TRANSPORT", "pubsub")
+    if kind == "pubsub":
+        return PubSubTransport(config)
+    if kind == "memory":
+        return InMemoryTransport(config)
+    raise ValueError(f"Unknown transport '{kind}', expected one of {TRANSPORTS}")
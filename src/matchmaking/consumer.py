@@ -1,69 +1,430 @@
 """
-Matchmaking Consumer using Google Pub/Sub
+Matchmaking Consumer using Google Pub/Sub (or the in-memory transport)
 """
 import logging
-import json
+import os
+import queue
 import signal
 import sys
+import threading
+import time
 from concurrent import futures
-from google.cloud import pubsub_v1
-from src.clients.pubsub_config import PubSubConfig
-from src.matchmaking.matchmaking_algorithm import MatchmakingAlgorithm
+from functools import partial
+from typing import List, Optional, Tuple, Union
+from src.clients.database import connect_db, close_db
+from src.clients.pubsub_config import PARTITION_ATTRIBUTE, PubSubConfig
+from src.clients.transport import Message, Transport, create_transport, delivered_at
+from src.matchmaking.dedup_cache import DedupCache
+from src.matchmaking.engines import create_matchmaker
+from src.matchmaking.flow_control import AdaptiveFlowControl
+from src.matchmaking.match_persister import MatchPersister
+from src.matchmaking.player_cache import PlayerCache, UnknownPlayerError
+from src.matchmaking.pool_snapshot import read_snapshot, write_snapshot
+from src.matchmaking.team_balancer import TeamBalancer
+from src.models.player_ticket import PlayerTicket
+from src.models.user_model import Region
+from src.models.wire_format import ENCODING_ATTRIBUTE, ENCODING_THIN, TICKET_ID_ATTRIBUTE, decode_thin
+from src.telemetry.logging_setup import EventSummary, configure_logging
+from src.telemetry.metrics import REGISTRY, STAGE_SECONDS, start_metrics_server
+from src.telemetry.profiler import SamplingProfiler
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+MESSAGES = REGISTRY.counter("matchmaking_messages_total", "Messages handled by the consumer", labels=("outcome",))
+MATCHES = REGISTRY.counter("matchmaking_matches_total", "Matches formed", labels=("region",))
+POOL_DEPTH = REGISTRY.gauge("matchmaking_pool_depth", "Players waiting for a match", labels=("region",))
+BUFFER_DEPTH = REGISTRY.gauge("matchmaking_buffer_depth", "Messages waiting for the matcher loop in batch mode")
+
+DECODE_SECONDS = STAGE_SECONDS.labels("decode")
+MATCH_SECONDS = STAGE_SECONDS.labels("match")
+TICK_SECONDS = STAGE_SECONDS.labels("tick")
+BALANCE_SECONDS = STAGE_SECONDS.labels("balance")
+ACK_SECONDS = STAGE_SECONDS.labels("ack")
+
+TEAM_IMBALANCE = REGISTRY.histogram(
+    "matchmaking_team_imbalance", "Difference in total MMR between the two teams of a lobby",
+    buckets=(0, 1, 2, 5, 10, 25, 50, 100, 250, 500),
+)
+
 
 class MatchmakingConsumer:
-    def __init__(self, config: PubSubConfig = None):
+    def __init__(self, config: PubSubConfig = None, batch_mode: Optional[bool] = None,
+                 batch_size: Optional[int] = None, batch_max_wait: Optional[float] = None,
+                 buffer_size: Optional[int] = None, persist_matches: Optional[bool] = None,
+                 transport: Optional[Transport] = None, snapshot_path: Optional[str] = None,
+                 adaptive_flow: Optional[bool] = None, persister: Optional[MatchPersister] = None):
         self.config = config or PubSubConfig.from_env()
-        self.subscriber = None
-        self.subscription_path = None
-        self.matchmaker = MatchmakingAlgorithm()
+        self.transport = transport or create_transport(config=self.config)
+        self.matchmaker = create_matchmaker()
         self.is_running = False
         self.messages_processed = 0
+        self.tick_interval = float(os.getenv("MATCHMAKING_TICK_INTERVAL", "0.5"))
+        # Formed lobbies are split into two teams of nearly equal total MMR
+        self.balancer: Optional[TeamBalancer] = (
+            TeamBalancer() if os.getenv("TEAM_BALANCE", "true").lower() == "true" else None
+        )
+
+        # Outstanding-message limit follows pool depth, batch time and ack latency
+        if adaptive_flow is None:
+            adaptive_flow = os.getenv("FLOW_CONTROL_ADAPTIVE", "false").lower() == "true"
+        self.flow: Optional[AdaptiveFlowControl] = AdaptiveFlowControl(
+            self.transport, self.matchmaker.pool_size, self.config.flow_max_messages, self.config.flow_max_bytes
+        ) if adaptive_flow else None
+
+        # Per-message and per-match events are aggregated, only a sample is logged in detail
+        self.summary = EventSummary(logger, "consumer")
+
+        # Micro-batching: callbacks only buffer messages, the matcher loop drains them
+        if batch_mode is None:
+            batch_mode = os.getenv("CONSUMER_BATCH_MODE", "false").lower() == "true"
+        self.batch_mode = batch_mode
+        self.batch_size = batch_size or int(os.getenv("MATCH_BATCH_SIZE", "500"))
+        self.batch_max_wait = batch_max_wait or float(os.getenv("MATCH_BATCH_MAX_WAIT", "0.05"))
+        # (message, time it was received) waiting for the matcher loop
+        self._buffer: queue.Queue = queue.Queue(maxsize=buffer_size or int(os.getenv("MATCH_BUFFER_SIZE", "10000")))
+        self._matcher: Optional[threading.Thread] = None
+
+        # Write-behind persistence of formed matches (needs the database)
+        if persist_matches is None:
+            persist_matches = os.getenv("PERSIST_MATCHES", "false").lower() == "true"
+        self.persister: Optional[MatchPersister] = persister or (MatchPersister() if persist_matches else None)
+
+        # Waiting players survive restarts through a pool snapshot file (disabled when no path is set)
+        self.snapshot_path = snapshot_path or os.getenv("POOL_SNAPSHOT_PATH") or None
+        self.snapshot_interval = float(os.getenv("POOL_SNAPSHOT_INTERVAL", "30"))
+        self.snapshot_max_age = float(os.getenv("POOL_SNAPSHOT_MAX_AGE", os.getenv("MATCHMAKING_MAX_WAIT", "300")))
+        self._snapshot_lock = threading.Lock()
+
+        # Redeliveries of a ticket seen within DEDUP_TTL seconds are acked and dropped (0 disables).
+        # Claims are per user_id and remember the ticket id, also after a match, so only a new
+        # ticket of the player (or their expiry) ends the claim.
+        dedup_ttl = float(os.getenv("DEDUP_TTL", "60"))
+        self.dedup: Optional[DedupCache] = DedupCache(
+            ttl=dedup_ttl, max_entries=int(os.getenv("DEDUP_MAX_ENTRIES", "100000"))
+        ) if dedup_ttl > 0 else None
+
+        # Thin messages (user_id + profile version) are resolved against the users table
+        cache_enabled = os.getenv("PLAYER_CACHE_ENABLED", "false").lower() == "true"
+        self.player_cache: Optional[PlayerCache] = (
+            PlayerCache() if cache_enabled or self.config.message_encoding == ENCODING_THIN else None
+        )
+        self._uses_database = self.player_cache is not None or (
+            self.persister is not None and self.persister.uses_database
+        )
+
+        # Read at scrape time, the sharded engine answers from the sizes its workers last reported
+        for region in Region:
+            POOL_DEPTH.labels(region.value).set_function(partial(self.matchmaker.pool_size, region.value))
+        BUFFER_DEPTH.set_function(self._buffer.qsize)
+
+        # kill -USR1 <pid> samples the callback threads and the matcher loop for PROFILE_DURATION seconds
+        self.profiler = SamplingProfiler("consumer")
 
         signal.signal(signal.SIGINT, self._signal_handler)
         signal.signal(signal.SIGTERM, self._signal_handler)
+        self.profiler.install_signal_handler()
 
     def _signal_handler(self, signum, frame):
         logger.info(f"Received signal {signum}, shutting down...")
+        # stop() writes the final pool snapshot, Cloud Run sends SIGTERM before recycling the instance
         self.stop()
         sys.exit(0)
 
-    def _callback(self, message: pubsub_v1.subscriber.message.Message):
+    def _callback(self, message: Message):
+        # From the transport's hand-over, so time queued for an executor thread counts towards ack latency
+        received_at = delivered_at(message) or time.perf_counter()
+        if self.config.partitions and not self._owns_partition(message):
+            return
+        if self.batch_mode:
+            self._buffer_message(message, received_at)
+            return
+        if self._is_duplicate(message):
+            return
+
         try:
-            user_data = json.loads(message.data.decode("utf-8"))
-            logger.info(f"Received user: {user_data.get('user_id')}")
+            with DECODE_SECONDS.time():
+                ticket = self._decode_tickets([message])[0]
+            if isinstance(ticket, Exception):
+                raise ticket
 
-            self.matchmaker.get_user(user_data)
-            
-            message.ack()
-            self.messages_processed += 1
+            with MATCH_SECONDS.time():
+                matches = self.matchmaker.get_user(ticket)
+            self._handle_matches(matches)
 
-            if self.messages_processed % 10 == 0:
-                logger.info(f"Processed {self.messages_processed} messages")
+            with ACK_SECONDS.time():
+                message.ack()
+            if self.flow:
+                self.flow.record_acks(1, time.perf_counter() - received_at)
+            self.messages_processed += 1
+            MESSAGES.labels("processed").inc()
+            self.summary.count("messages")
 
+        except UnknownPlayerError as e:
+            # Redelivering cannot help, the player is gone from the users table
+            logger.warning(f"Dropping message: {e}")
+            MESSAGES.labels("unknown_player").inc()
+            self.summary.count("unknown_players")
+            message.ack()
         except Exception as e:
             logger.error(f"Error processing message: {e}")
+            MESSAGES.labels("error").inc()
+            self.summary.count("errors")
+            self._release(message)
+            message.nack()
+
+    def _decode_tickets(self, messages: List[Message]) -> List[Union[PlayerTicket, Exception]]:
+        """Decode payloads into tickets, thin messages are resolved together in one cache lookup"""
+        results: List[Union[PlayerTicket, Exception, None]] = [None] * len(messages)
+        thin = []
+        for i, message in enumerate(messages):
+            attributes = message.attributes or {}
+            try:
+                if attributes.get(ENCODING_ATTRIBUTE) == ENCODING_THIN:
+                    if self.player_cache is None:
+                        raise ValueError("Thin message received but the player cache is disabled")
+                    thin.append((i, decode_thin(message.data, attributes)))
+                else:
+                    results[i] = PlayerTicket.from_wire(message.data, attributes)
+            except Exception as e:
+                results[i] = e
+
+        if thin:
+            resolved = self.player_cache.get_many([key for _, key in thin])
+            for i, (user_id, _) in thin:
+                results[i] = resolved[user_id]
+        return results
+
+    def _owns_partition(self, message: Message) -> bool:
+        """
+        Nack tickets of partitions this consumer does not own instead of matching them
+
+        The transport refuses to start on a subscription whose filter does not
+        match the configured partitions, so these only arrive when consumers
+        with different partitions share one subscription id. Matching them
+        here would put players of one partition into two pools. The nacked
+        ticket may go to a consumer sharing the subscription that owns it, or
+        back to this one; either way the foreign_partition count exposes the
+        misconfiguration.
+        """
+        partition = (message.attributes or {}).get(PARTITION_ATTRIBUTE)
+        if self.config.owns(partition):
+            return True
+        MESSAGES.labels("foreign_partition").inc()
+        self.summary.count("foreign_partitions")
+        if self.summary.sample():
+            logger.warning(f"Nacking ticket of partition {partition}, subscription "
+                           f"{self.config.subscription_id} should only carry {self.config.partitions}")
+        message.nack()
+        return False
+
+    def _is_duplicate(self, message: Message) -> bool:
+        """
+        Claim the message's user_id with its ticket, acking and dropping a ticket seen recently
+
+        The ticket is the publisher's ticket_id attribute, or the message_id for
+        publishers that do not set it (Pub/Sub keeps it across redeliveries).
+        """
+        attributes = message.attributes or {}
+        user_id = attributes.get("user_id")
+        ticket_id = attributes.get(TICKET_ID_ATTRIBUTE) or message.message_id
+        if self.dedup is None or not user_id or self.dedup.claim(user_id, ticket_id):
+            return False
+        MESSAGES.labels("duplicate").inc()
+        self.summary.count("duplicates")
+        message.ack()
+        return True
+
+    def _release(self, message: Message):
+        """Forget a claimed user_id so the redelivery of a failed message is processed"""
+        user_id = (message.attributes or {}).get("user_id")
+        if self.dedup is not None and user_id:
+            self.dedup.release(user_id)
+
+    def _release_expired(self):
+        """Forget the claims of players who left the pool without a match, they may queue again"""
+        expired = self.matchmaker.take_expired()
+        if self.dedup is not None:
+            for user_id in expired:
+                self.dedup.release(user_id)
+
+    def _buffer_message(self, message: Message, received_at: float):
+        """Hand a message to the matcher loop, nacking it if the buffer is full"""
+        try:
+            self._buffer.put_nowait((message, received_at))
+        except queue.Full:
+            logger.warning("Match buffer full, nacking message for redelivery")
+            MESSAGES.labels("buffer_full").inc()
             message.nack()
 
+    def _drain_batch(self, timeout: float) -> List[Tuple[Message, float]]:
+        """Wait up to `timeout` for a first message, then collect until size or deadline"""
+        try:
+            batch = [self._buffer.get(timeout=timeout) if timeout > 0 else self._buffer.get_nowait()]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.batch_max_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._buffer.get(timeout=remaining) if remaining > 0 else self._buffer.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _process_batch(self, batch: List[Message]):
+        batch = [message for message in batch if not self._is_duplicate(message)]
+        tickets = []
+        decoded = []
+        with DECODE_SECONDS.time():
+            decoded_tickets = self._decode_tickets(batch)
+        for message, ticket in zip(batch, decoded_tickets):
+            if isinstance(ticket, UnknownPlayerError):
+                logger.warning(f"Dropping message: {ticket}")
+                MESSAGES.labels("unknown_player").inc()
+                self.summary.count("unknown_players")
+                message.ack()
+            elif isinstance(ticket, Exception):
+                logger.error(f"Error decoding message: {ticket}")
+                MESSAGES.labels("error").inc()
+                self.summary.count("errors")
+                self._release(message)
+                message.nack()
+            else:
+                tickets.append(ticket)
+                decoded.append(message)
+
+        try:
+            with MATCH_SECONDS.time():
+                matches = self.matchmaker.add_users(tickets)
+        except Exception as e:
+            logger.error(f"Error matching batch of {len(decoded)} messages: {e}")
+            MESSAGES.labels("error").inc(len(decoded))
+            for message in decoded:
+                self._release(message)
+                message.nack()
+            return
+
+        with ACK_SECONDS.time():
+            for message in decoded:
+                message.ack()
+        self.messages_processed += len(decoded)
+        MESSAGES.labels("processed").inc(len(decoded))
+        self.summary.count("messages", len(decoded))
+        self.summary.count("batches", messages=len(decoded))
+        self._handle_matches(matches)
+
+    def _handle_matches(self, matches):
+        if self.balancer and matches:
+            with BALANCE_SECONDS.time():
+                self.balancer.balance(matches)
+        for match in matches:
+            MATCHES.labels(match['region']).inc()
+            if 'imbalance' in match:
+                TEAM_IMBALANCE.observe(match['imbalance'])
+                self.summary.count("matches", mmr_spread=match['mmr_spread'], imbalance=match['imbalance'])
+            else:
+                self.summary.count("matches", mmr_spread=match['mmr_spread'])
+            if self.summary.sample():
+                logger.info(
+                    f"Match {match['match_id'][:8]} formed in {match['region']} "
+                    f"(avg MMR: {match['avg_mmr']}, spread: {match['mmr_spread']}, "
+                    f"team imbalance: {match.get('imbalance', '-')}, "
+                    f"waiting: {self.matchmaker.pool_size(match['region'])})"
+                )
+            if self.persister:
+                self.persister.submit(match)
+
+    def _restore_snapshot(self):
+        started = time.perf_counter()
+        tickets = read_snapshot(self.snapshot_path, time.monotonic(), self.snapshot_max_age)
+        if not tickets:
+            return
+        # The snapshot has no ticket ids, restored players are claimed without one. While they
+        # wait, redeliveries are rejected by the pool as already waiting and their ticket id is
+        # recorded by the claim; a redelivery arriving only after their match is taken as a new ticket
+        if self.dedup is not None:
+            for ticket in tickets:
+                self.dedup.claim(ticket.user_id)
+        restored = self.matchmaker.restore(tickets)
+        logger.info(
+            f"Restored {restored} waiting players from {self.snapshot_path} "
+            f"in {(time.perf_counter() - started) * 1000:.1f}ms"
+        )
+
+    def _write_snapshot(self):
+        with self._snapshot_lock:
+            try:
+                started = time.perf_counter()
+                count = write_snapshot(self.snapshot_path, self.matchmaker.snapshot(), time.monotonic())
+                logger.debug(f"Pool snapshot of {count} players written in {(time.perf_counter() - started) * 1000:.1f}ms")
+            except Exception as e:
+                logger.error(f"Failed to write pool snapshot: {e}")
+
+    def _matcher_loop(self):
+        """Single thread that drains buffered batches and drives the search-window timers"""
+        next_tick = time.monotonic()
+        next_snapshot = time.monotonic() + self.snapshot_interval
+        while self.is_running:
+            try:
+                wait = max(0.0, next_tick - time.monotonic())
+                if self.batch_mode:
+                    batch = self._drain_batch(wait)
+                    if batch:
+                        started = time.perf_counter()
+                        self._process_batch([message for message, _ in batch])
+                        if self.flow:
+                            finished = time.perf_counter()
+                            self.flow.record_batch(finished - started)
+                            self.flow.record_acks(len(batch), sum(finished - received_at for _, received_at in batch))
+                else:
+                    time.sleep(wait)
+
+                if time.monotonic() >= next_tick:
+                    with TICK_SECONDS.time():
+                        matches = self.matchmaker.tick()
+                    self._handle_matches(matches)
+                    self._release_expired()
+                    next_tick = time.monotonic() + self.tick_interval
+
+                if self.snapshot_path and time.monotonic() >= next_snapshot:
+                    self._write_snapshot()
+                    next_snapshot = time.monotonic() + self.snapshot_interval
+            except Exception as e:
+                logger.error(f"Error in matcher loop: {e}")
+
     def start(self):
-        logger.info("Starting Pub/Sub consumer...")
+        logger.info(f"Starting consumer ({self.transport.name} transport)...")
+        start_metrics_server()
+        self.profiler.start_if_requested()
         try:
-            self.subscriber = pubsub_v1.SubscriberClient()
-            self.subscription_path = self.subscriber.subscription_path(
-                self.config.project_id, self.config.subscription_id
-            )
+            if self._uses_database:
+                if not connect_db():
+                    logger.error("FAILED: Could not connect to database")
+                    return
+            if self.persister:
+                self.persister.start()
+            if self.player_cache:
+                self.player_cache.start()
+
+            if self.snapshot_path:
+                self._restore_snapshot()
 
             self.is_running = True
             logger.info(f"Listening on subscription: {self.config.subscription_id}")
+            if self.config.partitions:
+                logger.info(f"Partitions ({self.config.partition_by}): {', '.join(self.config.partitions)}")
+            if self.batch_mode:
+                logger.info(f"Batch mode: up to {self.batch_size} messages every {self.batch_max_wait}s")
 
-            streaming_pull_future = self.subscriber.subscribe(
-                self.subscription_path, callback=self._callback
-            )
+            self._matcher = threading.Thread(target=self._matcher_loop, name="matcher", daemon=True)
+            self._matcher.start()
+            if self.flow:
+                logger.info(f"Adaptive flow control: {self.flow.min_messages}-{self.flow.max_messages} outstanding messages")
+                self.flow.start()
 
             with futures.ThreadPoolExecutor(max_workers=10) as executor:
+                streaming_pull_future = self.transport.subscribe(self._callback, executor)
                 try:
                     streaming_pull_future.result()
                 except Exception as e:
@@ -80,11 +441,81 @@ class MatchmakingConsumer:
         if not self.is_running:
             return
         self.is_running = False
-        logger.info(f"Stopping (processed {self.messages_processed} messages)")
-        if self.subscriber:
-            self.subscriber.close()
+        self.summary.flush()
+        self.profiler.stop()
+        duplicates = self.dedup.duplicates if self.dedup is not None else 0
+        logger.info(f"Stopping (processed {self.messages_processed} messages, dropped {duplicates} duplicates)")
+        if self._matcher and self._matcher is not threading.current_thread():
+            self._matcher.join(timeout=self.tick_interval + 5)
+        if self.flow:
+            self.flow.stop()
+
+        # Anything still buffered was never matched, let the transport redeliver it
+        while True:
+            try:
+                self._buffer.get_nowait()[0].nack()
+            except queue.Empty:
+                break
+
+        self.transport.close()
+        if self.snapshot_path:
+            self._write_snapshot()
+        # Lobbies the shard workers report while shutting down still need their balancing and persistence
+        self._handle_matches(self.matchmaker.close())
+        if self.player_cache:
+            self.player_cache.stop()
+            logger.info(
+                f"Player cache: {self.player_cache.hits} hits, {self.player_cache.misses} misses "
+                f"in {self.player_cache.lookups} lookups"
+            )
+        if self.persister:
+            self.persister.stop()
+            logger.info(f"Persisted {self.persister.persisted} matches ({self.persister.dropped} dropped)")
+        if self._uses_database:
+            close_db()
 
 
 if __name__ == "__main__":
-    consumer = MatchmakingConsumer()
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch", action="store_true", help="Enable micro-batching mode")
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--batch-max-wait", type=float, default=None)
+    parser.add_argument("--engine", choices=["scalar", "vectorized"], default=None,
+                        help="Matchmaking engine (default: MATCHMAKER_ENGINE or scalar)")
+    parser.add_argument("--sharded", action="store_true",
+                        help="Run one matchmaking worker process per region shard (see MATCHMAKER_SHARDS)")
+    parser.add_argument("--persist", action="store_true",
+                        help="Write formed matches and ingame flags to the database")
+    parser.add_argument("--transport", choices=["pubsub", "memory"], default=None,
+                        help="Message transport (default: MATCHMAKING_TRANSPORT or pubsub)")
+    parser.add_argument("--snapshot", default=None,
+                        help="Pool snapshot file to restore at startup and write periodically (default: POOL_SNAPSHOT_PATH)")
+    parser.add_argument("--partitions", default=None,
+                        help="Comma-separated partitions to consume, e.g. America,Europe (default: PUBSUB_PARTITIONS)")
+    parser.add_argument("--adaptive-flow", action="store_true",
+                        help="Adjust the outstanding-message limit to pool depth, batch time and ack latency")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="Serve Prometheus metrics on this port (default: METRICS_PORT, unset disables)")
+    args = parser.parse_args()
+    configure_logging()
+    if args.engine:
+        os.environ["MATCHMAKER_ENGINE"] = args.engine
+    if args.sharded:
+        os.environ["MATCHMAKER_SHARDED"] = "true"
+    if args.transport:
+        os.environ["MATCHMAKING_TRANSPORT"] = args.transport
+    if args.metrics_port is not None:
+        os.environ["METRICS_PORT"] = str(args.metrics_port)
+    if args.partitions is not None:
+        os.environ["PUBSUB_PARTITIONS"] = args.partitions
+
+    consumer = MatchmakingConsumer(
+        batch_mode=args.batch or None,
+        batch_size=args.batch_size,
+        batch_max_wait=args.batch_max_wait,
+        persist_matches=args.persist or None,
+        snapshot_path=args.snapshot,
+        adaptive_flow=args.adaptive_flow or None
+    )
     consumer.start()
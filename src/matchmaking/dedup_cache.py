@@ -0,0 +1,70 @@
+"""
+Dedup Cache
+Bounded TTL map of recently seen user ids to their ticket, drops redelivered tickets
+"""
+import time
+import threading
+from collections import OrderedDict
+from typing import Hashable, Optional, Tuple
+
+
+class DedupCache:
+    """
+    Remembers keys, and the ticket each was claimed with, for `ttl` seconds
+
+    A claim of a key with the ticket it already holds is a duplicate; a claim
+    with a different ticket replaces it (the player queued again). Every key
+    gets the same TTL and is moved to the end when claimed, so insertion
+    order is expiry order: expired keys are evicted from the front of an
+    OrderedDict, and when the cache is full the oldest key is evicted early.
+    claim() and release() are O(1) amortized and memory is bounded by
+    `max_entries`.
+    """
+
+    def __init__(self, ttl: float = 60.0, max_entries: int = 100000, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self.duplicates = 0
+        self.evicted = 0
+        # key -> (expiry time, ticket)
+        self._entries: "OrderedDict[Hashable, Tuple[float, Optional[Hashable]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry[0] > self.clock()
+
+    def claim(self, key: Hashable, ticket: Optional[Hashable] = None) -> bool:
+        """Record `key` with `ticket`, returns False if the key holds that same ticket within the TTL"""
+        with self._lock:
+            now = self.clock()
+            self._evict_expired(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] == ticket:
+                    self.duplicates += 1
+                    return False
+                del self._entries[key]
+            elif len(self._entries) >= self.max_entries:
+                self._entries.popitem(last=False)
+                self.evicted += 1
+            self._entries[key] = (now + self.ttl, ticket)
+            return True
+
+    def release(self, key: Hashable) -> None:
+        """Forget `key`, so a retry of a failed ticket is processed again"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def _evict_expired(self, now: float) -> None:
+        entries = self._entries
+        while entries:
+            key, (expires_at, _) = next(iter(entries.items()))
+            if expires_at > now:
+                break
+            del entries[key]
@@ -0,0 +1,31 @@
+"""
+Matchmaking Engines
+Selects the matchmaking engine used by the consumer
+"""
+import os
+from typing import Optional
+from src.matchmaking.matchmaking_algorithm import MatchmakingAlgorithm
+from src.matchmaking.sharding import ShardedMatchmaker
+from src.matchmaking.vectorized_algorithm import VectorizedMatchmakingAlgorithm
+
+ENGINES = {
+    "scalar": MatchmakingAlgorithm,
+    "vectorized": VectorizedMatchmakingAlgorithm,
+}
+
+
+def create_matchmaker(engine: Optional[str] = None, sharded: Optional[bool] = None, **kwargs):
+    """
+    Build a matchmaking engine by name, defaults to MATCHMAKER_ENGINE or "scalar"
+
+    With `sharded` (or MATCHMAKER_SHARDED=true) the engine runs in one worker
+    process per region shard instead of in the calling process.
+    """
+    engine = engine or os.getenv("MATCHMAKER_ENGINE", "scalar")
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown matchmaking engine '{engine}', expected one of {sorted(ENGINES)}")
+    if sharded is None:
+        sharded = os.getenv("MATCHMAKER_SHARDED", "false").lower() == "true"
+    if sharded:
+        return ShardedMatchmaker(engine=engine, **kwargs)
+    return ENGINES[engine](**kwargs)
@@ -0,0 +1,116 @@
+"""
+Adaptive Flow Control
+AIMD limit on outstanding messages, driven by pool depth, batch time and ack latency
+"""
+import os
+import logging
+import threading
+from typing import Callable, Optional
+from src.clients.transport import Transport
+from src.telemetry.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+FLOW_LIMIT = REGISTRY.gauge("matchmaking_flow_control_max_messages", "Outstanding message limit set by adaptive flow control")
+
+
+class AdaptiveFlowControl:
+    """
+    Adjusts the transport's outstanding-message limit every `interval` seconds
+
+    The consumer reports each message's latency from delivery to ack and
+    each batch's processing time. When, over the last interval, the mean
+    ack latency exceeds `target_latency`, the mean batch time exceeds
+    `max_batch_time`, or more than `max_pool` players are waiting, the limit
+    is halved (down to `min_messages`). Otherwise it grows by `step`
+    messages (up to `max_messages`). Fewer outstanding messages means less
+    queued in the callback executor and the batch buffer, so a burst waits
+    in the subscription instead of as unbounded in-process latency.
+    max_bytes is scaled along with the message limit.
+    """
+
+    def __init__(self, transport: Transport, pool_size: Callable[[], int],
+                 max_messages: int, max_bytes: int, min_messages: Optional[int] = None,
+                 step: Optional[int] = None, interval: Optional[float] = None,
+                 target_latency: Optional[float] = None, max_batch_time: Optional[float] = None,
+                 max_pool: Optional[int] = None):
+        self.transport = transport
+        self.pool_size = pool_size
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.min_messages = min_messages or int(os.getenv("FLOW_MIN_MESSAGES", "50"))
+        self.step = step or int(os.getenv("FLOW_STEP", "100"))
+        self.interval = interval or float(os.getenv("FLOW_INTERVAL", "2.0"))
+        self.target_latency = target_latency or float(os.getenv("FLOW_TARGET_LATENCY", "1.0"))
+        self.max_batch_time = max_batch_time or float(os.getenv("FLOW_MAX_BATCH_TIME", "0.5"))
+        self.max_pool = max_pool or int(os.getenv("FLOW_MAX_POOL", "50000"))
+
+        self.limit = max_messages
+        FLOW_LIMIT.set(self.limit)
+        self._ack_latency_total = 0.0
+        self._acks = 0
+        self._batch_time_total = 0.0
+        self._batches = 0
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="flow-control", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout=self.interval + 1)
+
+    def record_acks(self, count: int, total_latency: float):
+        """`count` messages acked, `total_latency` seconds summed over their delivery-to-ack times"""
+        with self._lock:
+            self._acks += count
+            self._ack_latency_total += total_latency
+
+    def record_batch(self, seconds: float):
+        with self._lock:
+            self._batches += 1
+            self._batch_time_total += seconds
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            try:
+                self.adjust()
+            except Exception as e:
+                logger.error(f"Flow control update failed: {e}")
+
+    def adjust(self) -> int:
+        """Take the last interval's measurements and move the limit, returns the new limit"""
+        with self._lock:
+            ack_latency = self._ack_latency_total / self._acks if self._acks else 0.0
+            batch_time = self._batch_time_total / self._batches if self._batches else 0.0
+            self._ack_latency_total, self._acks = 0.0, 0
+            self._batch_time_total, self._batches = 0.0, 0
+        pool = self.pool_size()
+
+        reason = None
+        if ack_latency > self.target_latency:
+            reason = f"ack latency {ack_latency:.2f}s"
+        elif batch_time > self.max_batch_time:
+            reason = f"batch time {batch_time:.2f}s"
+        elif pool > self.max_pool:
+            reason = f"{pool} players waiting"
+
+        if reason:
+            limit = max(self.min_messages, self.limit // 2)
+        else:
+            limit = min(self.max_messages, self.limit + self.step)
+
+        max_bytes = max(1, self.max_bytes * limit // self.max_messages)
+        # Offered every interval: the transport may hold back small or too frequent
+        # changes, which are then applied once they have accumulated
+        applied = self.transport.set_flow_control(limit, max_bytes)
+        if reason and limit != self.limit:
+            logger.info(f"Flow control: {self.limit} -> {limit} outstanding messages ({reason})"
+                        f"{'' if applied else ', not applied yet'}")
+        self.limit = limit
+        FLOW_LIMIT.set(limit)
+        return limit
@@ -0,0 +1,144 @@
+"""
+Match Persister
+Write-behind storage of formed matches and the players' ingame flags
+"""
+import os
+import time
+import queue
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+from sqlalchemy import insert, text
+from src.clients import database
+from src.models.match_model import MatchModel
+from src.telemetry.metrics import REGISTRY, STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+PERSISTED = REGISTRY.counter("matchmaking_persisted_matches_total", "Matches written or given up on", labels=("outcome",))
+PERSIST_SECONDS = STAGE_SECONDS.labels("persist")
+
+MARK_INGAME = text("UPDATE users SET ingame = true WHERE user_id = ANY(CAST(:user_ids AS varchar[]))")
+
+
+class MatchPersister:
+    """
+    Buffers formed matches and writes them in batched transactions
+
+    A background thread flushes when `flush_size` matches are buffered or
+    `flush_interval` seconds have passed. Each flush is one transaction with
+    a single multi-row insert into matches and a single UPDATE of the users'
+    ingame flags. submit() never waits on the database: it only blocks when
+    the buffer is full, and for at most `durability_window` seconds before
+    the match is dropped and counted in `dropped`. While the buffer stays
+    full, further matches are dropped without waiting.
+    """
+
+    # Whether the consumer has to connect_db() first, off for subclasses that write elsewhere
+    uses_database = True
+
+    def __init__(self, flush_size: Optional[int] = None, flush_interval: Optional[float] = None,
+                 max_pending: Optional[int] = None, durability_window: Optional[float] = None):
+        self.flush_size = flush_size or int(os.getenv("MATCH_FLUSH_SIZE", "200"))
+        self.flush_interval = flush_interval or float(os.getenv("MATCH_FLUSH_INTERVAL", "1.0"))
+        self.durability_window = durability_window or float(os.getenv("MATCH_DURABILITY_WINDOW", "5.0"))
+        self._pending: queue.Queue = queue.Queue(maxsize=max_pending or int(os.getenv("MATCH_MAX_PENDING", "10000")))
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._overflowing = False
+
+        self.persisted = 0
+        self.dropped = 0
+        self.failed_flushes = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="match-persister", daemon=True)
+        self._thread.start()
+
+    def submit(self, match: Dict) -> bool:
+        try:
+            if self._overflowing:
+                # Already waited out one window, don't stall the matcher again until there is room
+                self._pending.put_nowait(match)
+            else:
+                self._pending.put(match, timeout=self.durability_window)
+            self._overflowing = False
+            return True
+        except queue.Full:
+            self._overflowing = True
+            self.dropped += 1
+            PERSISTED.labels("dropped").inc()
+            logger.error(f"Match buffer full for {self.durability_window}s, dropping match {match['match_id']}")
+            return False
+
+    def stop(self, timeout: float = 10.0):
+        """Flush whatever is still buffered and stop the writer thread"""
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+
+    def _run(self):
+        batch: List[Dict] = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            stopping = self._stopping.is_set()
+            if stopping and not batch and self._pending.empty():
+                break
+
+            if len(batch) < self.flush_size:
+                self._collect(batch, max(0.0, deadline - time.monotonic()))
+            else:
+                # A failing database: stop pulling so submit() applies backpressure
+                self._stopping.wait(max(0.0, deadline - time.monotonic()))
+
+            due = time.monotonic() >= deadline
+            if batch and (len(batch) >= self.flush_size or due or stopping):
+                if self._flush(batch):
+                    batch = []
+                elif stopping:
+                    logger.error(f"Giving up on {len(batch)} unpersisted matches at shutdown")
+                    self.dropped += len(batch)
+                    PERSISTED.labels("dropped").inc(len(batch))
+                    batch = []
+                deadline = time.monotonic() + self.flush_interval
+            elif due:
+                deadline = time.monotonic() + self.flush_interval
+
+    def _collect(self, batch: List[Dict], timeout: float):
+        """Wait up to `timeout` for one match, then take whatever else is already buffered"""
+        try:
+            batch.append(self._pending.get(timeout=timeout))
+            while len(batch) < self.flush_size:
+                batch.append(self._pending.get_nowait())
+        except queue.Empty:
+            pass
+
+    def _flush(self, batch: List[Dict]) -> bool:
+        now = datetime.now()
+        rows = [
+            {
+                "match_id": match["match_id"],
+                "region": match["region"],
+                "avg_mmr": match["avg_mmr"],
+                "mmr_spread": match["mmr_spread"],
+                "player_ids": [player.user_id for player in match["players"]],
+                "created_at": now,
+            }
+            for match in batch
+        ]
+        user_ids = [user_id for row in rows for user_id in row["player_ids"]]
+        try:
+            with PERSIST_SECONDS.time(), database.engine.begin() as conn:
+                conn.execute(insert(MatchModel.__table__), rows)
+                conn.execute(MARK_INGAME, {"user_ids": user_ids})
+        except Exception as e:
+            # Keep the batch, it is retried on the next flush
+            self.failed_flushes += 1
+            logger.error(f"Failed to persist {len(batch)} matches: {e}")
+            return False
+
+        self.persisted += len(batch)
+        PERSISTED.labels("persisted").inc(len(batch))
+        logger.debug(f"Persisted {len(batch)} matches ({len(user_ids)} players)")
+        return True
@@ -2,15 +2,228 @@
 Matchmaking Algorithm
 Handles user matchmaking logic
 """
+import os
+import math
+import time
+import uuid
 import logging
-from typing import List, Dict
-from src.models.user_model import UserModel
+import threading
+from collections import deque
+from typing import Deque, List, Dict, Iterable, Optional, Union
+from src.matchmaking.mmr_pool import MMRBucketPool
+from src.matchmaking.timing_wheel import TimingWheel
+from src.models.player_ticket import PlayerTicket
 
 logger = logging.getLogger(__name__)
 
+# Timer events scheduled per waiting ticket
+WIDEN = "widen"
+EXPIRE = "expire"
+
+# Expired user ids kept until take_expired() is called, the oldest are dropped beyond this
+EXPIRED_BUFFER_SIZE = 100000
+
 
 class MatchmakingAlgorithm:
     """Simple matchmaking algorithm that groups players by MMR"""
 
-    def get_user(self, user_data: Dict) -> None:
-        print(f"Processing user for matchmaking: {user_data}")
+    def __init__(self, lobby_size: Optional[int] = None, base_window: Optional[int] = None,
+                 bucket_width: Optional[int] = None, widen_interval: Optional[float] = None,
+                 widen_step: Optional[int] = None, max_window: Optional[int] = None,
+                 max_wait: Optional[float] = None, seed: Optional[int] = None, clock=time.monotonic):
+        self.lobby_size = lobby_size or int(os.getenv("LOBBY_SIZE", "10"))
+        self.base_window = base_window or int(os.getenv("MMR_BASE_WINDOW", "100"))
+        self.bucket_width = bucket_width or int(os.getenv("MMR_BUCKET_WIDTH", "25"))
+        self.widen_interval = widen_interval or float(os.getenv("MMR_WIDEN_INTERVAL", "5"))
+        self.widen_step = widen_step or int(os.getenv("MMR_WIDEN_STEP", "50"))
+        self.max_window = max_window or int(os.getenv("MMR_MAX_WINDOW", "1000"))
+        self.max_wait = max_wait or float(os.getenv("MATCHMAKING_MAX_WAIT", "300"))
+        self.seed = seed  # accepted for parity with the vectorized engine, no random choices here
+        self.clock = clock
+        self.pools: Dict[str, MMRBucketPool] = {}
+        self.timers = TimingWheel(start=clock())
+        self.matches_formed = 0
+        self.tickets_expired = 0
+        self.expired_users: Deque[str] = deque(maxlen=EXPIRED_BUFFER_SIZE)
+        self._lock = threading.Lock()
+
+    def get_user(self, user_data: Union[PlayerTicket, Dict]) -> List[Dict]:
+        """Queue a single player and return any lobbies formed because of it"""
+        with self._lock:
+            return self._enqueue(user_data)
+
+    def add_users(self, users: Iterable[Union[PlayerTicket, Dict]]) -> List[Dict]:
+        """Queue a batch of players under a single lock acquisition"""
+        matches = []
+        with self._lock:
+            for user_data in users:
+                matches.extend(self._enqueue(user_data))
+        return matches
+
+    def remove_user(self, user_id: str) -> bool:
+        """Take a waiting player out of the queue"""
+        with self._lock:
+            for pool in self.pools.values():
+                if pool.remove(user_id) is not None:
+                    self.timers.cancel(user_id)
+                    return True
+        return False
+
+    def tick(self, now: Optional[float] = None) -> List[Dict]:
+        """
+        Fire due widen/expire timers and return lobbies formed by widening
+
+        Only tickets whose timer is due are visited, so the cost of a tick
+        does not depend on how many players are waiting.
+        """
+        matches = []
+        with self._lock:
+            now = self.clock() if now is None else now
+            for user_id, (event, region) in self.timers.advance(now):
+                pool = self.pools.get(region)
+                ticket = pool.get(user_id) if pool else None
+                if ticket is None:
+                    continue
+
+                if event == EXPIRE:
+                    pool.remove(user_id)
+                    self.tickets_expired += 1
+                    self.expired_users.append(user_id)
+                    logger.debug(f"User {user_id} expired after {now - ticket.enqueued_at:.0f}s")
+                    continue
+
+                ticket.window = min(ticket.window + self.widen_step, self.max_window)
+                match = self._try_match(pool, ticket)
+                if match:
+                    matches.append(match)
+                else:
+                    self._schedule(ticket, now)
+        return matches
+
+    def pool_size(self, region: Optional[str] = None) -> int:
+        """Number of waiting players, optionally for a single region"""
+        if region is not None:
+            pool = self.pools.get(region)
+            return len(pool) if pool else 0
+        return sum(len(pool) for pool in self.pools.values())
+
+    def take_expired(self) -> List[str]:
+        """User ids of players expired since the last call, for the consumer to forget their claims"""
+        with self._lock:
+            expired = list(self.expired_users)
+            self.expired_users.clear()
+        return expired
+
+    def snapshot(self) -> List[PlayerTicket]:
+        """Every waiting player, for writing a pool snapshot"""
+        with self._lock:
+            return [ticket for pool in self.pools.values() for ticket in pool.index.values()]
+
+    def restore(self, tickets: Iterable[PlayerTicket]) -> int:
+        """
+        Queue players from a pool snapshot, keeping their wait and search window
+
+        Tickets must already carry `enqueued_at` on this engine's clock.
+        Players that are already waiting are skipped. No lobbies are formed
+        here; restored players match on their next widen step or with new
+        arrivals, and the ones past max_wait expire on the next tick.
+        """
+        restored = 0
+        with self._lock:
+            now = self.clock()
+            for ticket in tickets:
+                pool = self.pools.get(ticket.region)
+                if pool is None:
+                    pool = self.pools[ticket.region] = MMRBucketPool(self.bucket_width)
+                if pool.insert(ticket):
+                    self._schedule(ticket, now)
+                    restored += 1
+        return restored
+
+    def close(self) -> List[Dict]:
+        """Nothing to release or drain, present for interface parity with ShardedMatchmaker"""
+        return []
+
+    def _enqueue(self, user_data: Union[PlayerTicket, Dict]) -> List[Dict]:
+        if isinstance(user_data, PlayerTicket):
+            ticket = user_data
+        else:
+            ticket = PlayerTicket.from_dict(user_data)
+        ticket.enqueued_at = self.clock()
+        ticket.window = self.base_window
+
+        pool = self.pools.get(ticket.region)
+        if pool is None:
+            pool = self.pools[ticket.region] = MMRBucketPool(self.bucket_width)
+
+        if not pool.insert(ticket):
+            logger.debug(f"User {ticket.user_id} is already waiting")
+            return []
+
+        match = self._try_match(pool, ticket)
+        if match:
+            return [match]
+        self._schedule(ticket, ticket.enqueued_at)
+        return []
+
+    def _schedule(self, ticket: PlayerTicket, now: float) -> None:
+        """
+        Arm the next widen step, or the expiry once the window is maxed out
+
+        Widen steps sit on a fixed grid of widen_interval from the enqueue time,
+        so a timer that fires late does not push back every later step.
+        """
+        expires_at = ticket.enqueued_at + self.max_wait
+        steps = math.floor((now - ticket.enqueued_at) / self.widen_interval + 1e-6) + 1
+        widen_at = ticket.enqueued_at + steps * self.widen_interval
+        if ticket.window < self.max_window and widen_at < expires_at:
+            self.timers.schedule(ticket.user_id, widen_at, (WIDEN, ticket.region))
+        else:
+            self.timers.schedule(ticket.user_id, expires_at, (EXPIRE, ticket.region))
+
+    def _try_match(self, pool: MMRBucketPool, anchor: PlayerTicket) -> Optional[Dict]:
+        """
+        Form a lobby around `anchor` if its MMR spread fits inside the anchor's window
+
+        The window bounds the spread (highest minus lowest MMR) of the whole
+        lobby, the same rule as the vectorized engine. The tightest lobby
+        containing the anchor is always made of its 2 * (lobby_size - 1)
+        nearest players, so only those are fetched and the lowest-spread run
+        of `lobby_size` consecutive players through the anchor is taken.
+        """
+        needed = self.lobby_size - 1
+        nearby = pool.nearest(anchor.mmr, anchor.window, 2 * needed, exclude=anchor.user_id)
+        if len(nearby) < needed:
+            return None
+
+        ordered = sorted(nearby + [anchor], key=lambda ticket: ticket.mmr)
+        position = next(i for i, ticket in enumerate(ordered) if ticket is anchor)
+        best_spread, best_start = None, None
+        for start in range(max(0, position - needed), min(position, len(ordered) - self.lobby_size) + 1):
+            spread = ordered[start + needed].mmr - ordered[start].mmr
+            if spread <= anchor.window and (best_spread is None or spread < best_spread):
+                best_spread, best_start = spread, start
+        if best_start is None:
+            return None
+
+        players = [anchor] + [ticket for ticket in ordered[best_start:best_start + self.lobby_size]
+                              if ticket is not anchor]
+        for player in players:
+            pool.remove(player.user_id)
+            self.timers.cancel(player.user_id)
+
+        self.matches_formed += 1
+        return make_match(anchor.region, players)
+
+
+def make_match(region: str, players: List[PlayerTicket]) -> Dict:
+    """Build the lobby record handed from a matchmaking engine to the consumer"""
+    mmrs = [player.mmr for player in players]
+    return {
+        "match_id": str(uuid.uuid4()),
+        "region": region,
+        "players": players,
+        "avg_mmr": sum(mmrs) // len(mmrs),
+        "mmr_spread": max(mmrs) - min(mmrs),
+        "created_at": time.time(),
+    }
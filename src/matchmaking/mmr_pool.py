@@ -0,0 +1,96 @@
+"""
+MMR Bucket Pool
+In-memory waiting pool for one region, indexed by fixed-width MMR buckets
+"""
+from typing import Dict, List, Optional
+from src.models.player_ticket import PlayerTicket
+
+
+class MMRBucketPool:
+    """
+    Waiting players of a single region grouped into fixed-width MMR buckets.
+
+    Insert and remove are O(1). Finding the nearest players costs one dict
+    lookup per bucket inside the search window plus the number of players
+    returned, independent of how many players are waiting. Players inside a
+    bucket are not ordered, so results are exact up to one bucket width.
+    """
+
+    def __init__(self, bucket_width: int = 25):
+        self.bucket_width = bucket_width
+        self.buckets: Dict[int, Dict[str, PlayerTicket]] = {}
+        self.index: Dict[str, PlayerTicket] = {}
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self.index
+
+    def get(self, user_id: str) -> Optional[PlayerTicket]:
+        return self.index.get(user_id)
+
+    def insert(self, ticket: PlayerTicket) -> bool:
+        """Add a ticket, returns False if the user is already waiting"""
+        user_id = ticket.user_id
+        if user_id in self.index:
+            return False
+        self.index[user_id] = ticket
+        bucket_id = ticket.mmr // self.bucket_width
+        bucket = self.buckets.get(bucket_id)
+        if bucket is None:
+            bucket = self.buckets[bucket_id] = {}
+        bucket[user_id] = ticket
+        return True
+
+    def remove(self, user_id: str) -> Optional[PlayerTicket]:
+        """Remove a ticket by user id, returns the ticket if it was waiting"""
+        ticket = self.index.pop(user_id, None)
+        if ticket is None:
+            return None
+        bucket_id = ticket.mmr // self.bucket_width
+        bucket = self.buckets[bucket_id]
+        del bucket[user_id]
+        if not bucket:
+            del self.buckets[bucket_id]
+        return ticket
+
+    def nearest(self, mmr: int, window: int, count: int, exclude: Optional[str] = None) -> List[PlayerTicket]:
+        """
+        Find up to `count` players within `window` MMR of `mmr`
+
+        Buckets are visited in rings moving outwards from the bucket holding
+        `mmr`, so the closest players are collected first and the scan stops
+        as soon as enough players have been found. Both buckets of a ring may
+        contribute everything still needed before the ring is sorted by
+        distance and cut, so neither side of `mmr` is preferred.
+        """
+        width = self.bucket_width
+        center = mmr // width
+        lowest = (mmr - window) // width
+        highest = (mmr + window) // width
+        found: List[PlayerTicket] = []
+
+        for distance in range(max(center - lowest, highest - center) + 1):
+            ring = [center - distance, center + distance] if distance else [center]
+            candidates = []
+            for bucket_id in ring:
+                if bucket_id < lowest or bucket_id > highest:
+                    continue
+                bucket = self.buckets.get(bucket_id)
+                if not bucket:
+                    continue
+                needed = count - len(found)
+                for ticket in bucket.values():
+                    if needed <= 0:
+                        break
+                    if ticket.user_id != exclude and abs(ticket.mmr - mmr) <= window:
+                        candidates.append(ticket)
+                        needed -= 1
+            if candidates:
+                candidates.sort(key=lambda t: abs(t.mmr - mmr))
+                found.extend(candidates[:count - len(found)])
+            if len(found) >= count:
+                break
+
+        return found
@@ -0,0 +1,170 @@
+"""
+Player Cache
+Read-through LRU/TTL cache of player profiles for thin matchmaking messages
+"""
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from concurrent import futures
+from typing import Callable, Dict, List, Optional, Tuple, Union
+from sqlalchemy import text
+from src.clients import database
+from src.models.player_ticket import PlayerTicket
+from src.models.wire_format import profile_version
+
+logger = logging.getLogger(__name__)
+
+LOOKUP_PLAYERS = text(
+    "SELECT user_id, mmr, region, level, games_played, updated_at FROM users "
+    "WHERE user_id = ANY(CAST(:user_ids AS varchar[]))"
+)
+
+# mmr, region, level, games_played
+Profile = Tuple[int, str, int, int]
+
+
+class UnknownPlayerError(LookupError):
+    """A thin message referred to a user_id that is not in the users table"""
+
+
+class PlayerCache:
+    """
+    Resolves (user_id, version) pairs to tickets, loading misses in batches
+
+    Cached profiles are served while they are younger than `ttl` seconds and
+    at least as new as the version a message asks for; the least recently
+    used profile is evicted beyond `max_entries`. Misses from all callers go
+    to one loader thread, which waits up to `max_wait` seconds for more
+    misses and then fetches up to `batch_size` of them with a single
+    `user_id = ANY(...)` query. A user already being fetched is not
+    requested twice, later callers wait on the same lookup.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, ttl: Optional[float] = None,
+                 batch_size: Optional[int] = None, max_wait: Optional[float] = None,
+                 loader: Optional[Callable[[List[str]], Dict[str, Tuple[Profile, int]]]] = None,
+                 clock=time.monotonic):
+        self.max_entries = max_entries or int(os.getenv("PLAYER_CACHE_SIZE", "100000"))
+        self.ttl = ttl or float(os.getenv("PLAYER_CACHE_TTL", "300"))
+        self.batch_size = batch_size or int(os.getenv("PLAYER_CACHE_BATCH_SIZE", "500"))
+        self.max_wait = max_wait or float(os.getenv("PLAYER_CACHE_MAX_WAIT", "0.005"))
+        self.lookup_timeout = float(os.getenv("PLAYER_CACHE_LOOKUP_TIMEOUT", "10"))
+        self.loader = loader or load_profiles
+        self.clock = clock
+
+        # user_id -> (profile, version, expires_at), least recently used first
+        self._entries: "OrderedDict[str, Tuple[Profile, int, float]]" = OrderedDict()
+        self._pending: Dict[str, futures.Future] = {}
+        self._queue: List[str] = []
+        self._changed = threading.Condition()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.lookups = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="player-cache-loader", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._changed:
+            self._stopping = True
+            self._changed.notify_all()
+        if self._thread:
+            self._thread.join(timeout=self.lookup_timeout)
+
+    def get_many(self, keys: List[Tuple[str, int]]) -> Dict[str, Union[PlayerTicket, Exception]]:
+        """Resolve (user_id, version) pairs, blocking until every miss has been loaded"""
+        results: Dict[str, Union[PlayerTicket, Exception]] = {}
+        waiting: Dict[str, futures.Future] = {}
+        with self._changed:
+            now = self.clock()
+            for user_id, version in keys:
+                entry = self._entries.get(user_id)
+                if entry is not None and entry[1] >= version and entry[2] > now:
+                    self._entries.move_to_end(user_id)
+                    self.hits += 1
+                    results[user_id] = PlayerTicket(user_id, *entry[0])
+                    continue
+
+                self.misses += 1
+                future = self._pending.get(user_id)
+                if future is None:
+                    future = self._pending[user_id] = futures.Future()
+                    self._queue.append(user_id)
+                else:
+                    self.coalesced += 1
+                waiting[user_id] = future
+            if self._queue:
+                self._changed.notify_all()
+
+        for user_id, future in waiting.items():
+            try:
+                results[user_id] = PlayerTicket(user_id, *future.result(timeout=self.lookup_timeout))
+            except Exception as e:
+                results[user_id] = e
+        return results
+
+    def _run(self):
+        while True:
+            with self._changed:
+                while not self._queue and not self._stopping:
+                    self._changed.wait()
+                if self._stopping:
+                    self._fail_pending(RuntimeError("Player cache stopped"))
+                    return
+                # Give concurrent callbacks a moment to add their misses to this round trip
+                deadline = time.monotonic() + self.max_wait
+                while len(self._queue) < self.batch_size and not self._stopping:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._changed.wait(remaining)
+                user_ids = self._queue[:self.batch_size]
+                del self._queue[:self.batch_size]
+
+            try:
+                profiles = self.loader(user_ids)
+                error = None
+            except Exception as e:
+                logger.error(f"Failed to load {len(user_ids)} player profiles: {e}")
+                profiles, error = {}, e
+            self._complete(user_ids, profiles, error)
+
+    def _complete(self, user_ids: List[str], profiles: Dict[str, Tuple[Profile, int]], error: Optional[Exception]):
+        with self._changed:
+            self.lookups += 1
+            expires_at = self.clock() + self.ttl
+            for user_id in user_ids:
+                future = self._pending.pop(user_id)
+                loaded = profiles.get(user_id)
+                if loaded is None:
+                    future.set_exception(error or UnknownPlayerError(f"User {user_id} does not exist"))
+                    continue
+                profile, version = loaded
+                self._entries[user_id] = (profile, version, expires_at)
+                self._entries.move_to_end(user_id)
+                future.set_result(profile)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _fail_pending(self, error: Exception):
+        for future in self._pending.values():
+            future.set_exception(error)
+        self._pending.clear()
+        self._queue.clear()
+
+
+def load_profiles(user_ids: List[str]) -> Dict[str, Tuple[Profile, int]]:
+    """Fetch matchmaking fields and profile versions for `user_ids` in one query"""
+    with database.engine.connect() as conn:
+        rows = conn.execute(LOOKUP_PLAYERS, {"user_ids": user_ids})
+        return {
+            row.user_id: ((row.mmr, row.region, row.level or 1, row.games_played or 0), profile_version(row.updated_at))
+            for row in rows
+        }
@@ -0,0 +1,95 @@
+"""
+Pool Snapshot
+Compact binary file of the waiting players, written periodically and at shutdown
+"""
+import os
+import time
+import uuid
+import struct
+import logging
+from typing import Iterable, List
+from src.models.player_ticket import PlayerTicket
+from src.models.wire_format import REGION_CODES, REGION_NAMES
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_MAGIC = b"MMPOOL"
+SNAPSHOT_VERSION = 1
+
+# magic, version, written at (unix time), ticket count
+HEADER_STRUCT = struct.Struct("<6sHdI")
+# user_id (binary UUID), region code, mmr, games_played, level, seconds waited, search window
+TICKET_STRUCT = struct.Struct("<16sBHIHfI")
+
+
+def write_snapshot(path: str, tickets: Iterable[PlayerTicket], now: float) -> int:
+    """
+    Write `tickets` to `path`, returns how many were written
+
+    Wait times are stored relative to `now` (the engine's clock) so they
+    survive a restart onto a new monotonic clock. The file is written next
+    to `path` and renamed over it, a crash never leaves a torn snapshot.
+    Tickets whose user_id is not a UUID cannot be stored and are skipped.
+    """
+    records = []
+    skipped = 0
+    for ticket in tickets:
+        try:
+            records.append(TICKET_STRUCT.pack(
+                uuid.UUID(ticket.user_id).bytes,
+                REGION_CODES[ticket.region],
+                ticket.mmr,
+                ticket.games_played,
+                ticket.level,
+                max(0.0, now - ticket.enqueued_at),
+                ticket.window,
+            ))
+        except (ValueError, KeyError, struct.error):
+            skipped += 1
+    if skipped:
+        logger.warning(f"Left {skipped} tickets out of the pool snapshot, they cannot be packed")
+
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(HEADER_STRUCT.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, time.time(), len(records)))
+        f.write(b"".join(records))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+    return len(records)
+
+
+def read_snapshot(path: str, now: float, max_age: float) -> List[PlayerTicket]:
+    """
+    Load tickets from `path` with `enqueued_at` rebased onto the clock value `now`
+
+    Time since the snapshot was written counts as waiting. Missing, stale
+    (older than `max_age` seconds) or unreadable snapshots yield no tickets.
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return []
+
+    try:
+        magic, version, written_at, count = HEADER_STRUCT.unpack_from(data)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError(f"unknown format {magic!r} v{version}")
+        if len(data) != HEADER_STRUCT.size + count * TICKET_STRUCT.size:
+            raise ValueError("truncated")
+    except (struct.error, ValueError) as e:
+        logger.error(f"Ignoring unreadable pool snapshot {path}: {e}")
+        return []
+
+    age = max(0.0, time.time() - written_at)
+    if age > max_age:
+        logger.info(f"Ignoring pool snapshot {path} from {age:.0f}s ago")
+        return []
+
+    return [
+        PlayerTicket(str(uuid.UUID(bytes=user_id)), mmr, REGION_NAMES.get(region, "Unknown"),
+                     level, games_played, now - waited - age, window)
+        for user_id, region, mmr, games_played, level, waited, window
+        in TICKET_STRUCT.iter_unpack(memoryview(data)[HEADER_STRUCT.size:])
+    ]
@@ -0,0 +1,321 @@
+"""
+Sharded Matchmaking
+Runs one matchmaking engine per region shard in its own worker process
+"""
+import os
+import time
+import queue
+import bisect
+import signal
+import logging
+import itertools
+import threading
+import multiprocessing
+from collections import deque
+from statistics import NormalDist
+from typing import Deque, List, Dict, Iterable, Optional, Tuple, Union
+from src.matchmaking.matchmaking_algorithm import EXPIRED_BUFFER_SIZE
+from src.models.player_ticket import PlayerTicket
+from src.models.user_model import Region
+
+logger = logging.getLogger(__name__)
+
+# Work items sent to a shard
+ADD = "add"
+REMOVE = "remove"
+RESTORE = "restore"
+SNAPSHOT = "snapshot"
+
+# Seconds between checks that every shard worker is still running
+LIVENESS_CHECK_INTERVAL = 1.0
+
+
+def parse_shard_spec(spec: str) -> Dict[str, int]:
+    """
+    Parse "America:3,Europe:2" into shard counts per region
+
+    Regions that are not listed get a single shard.
+    """
+    counts = {region.value: 1 for region in Region}
+    for part in filter(None, (item.strip() for item in spec.split(","))):
+        region, _, count = part.partition(":")
+        counts[Region(region.strip()).value] = max(1, int(count or 1))
+    return counts
+
+
+def mmr_band_edges(shards: int, mean: float, std: float) -> List[int]:
+    """
+    MMR boundaries that split a region into equally loaded bands
+
+    Edges are quantiles of the normal MMR distribution the data generator
+    draws from, so each band receives about the same share of players.
+    """
+    distribution = NormalDist(mean, std)
+    return [int(distribution.inv_cdf(i / shards)) for i in range(1, shards)]
+
+
+def _run_shard(shard_id: int, engine: Optional[str], engine_kwargs: Dict, inbox: multiprocessing.Queue,
+               outbox: multiprocessing.Queue, replies: multiprocessing.Queue, tick_interval: float):
+    """Worker process main loop: apply work items, tick the engine, report matches"""
+    from src.matchmaking.engines import create_matchmaker
+
+    # Shutdown is coordinated by the parent through a sentinel on the inbox
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    matchmaker = create_matchmaker(engine, sharded=False, **engine_kwargs)
+    next_tick = time.monotonic() + tick_interval
+    while True:
+        try:
+            item = inbox.get(timeout=max(0.0, next_tick - time.monotonic()))
+        except queue.Empty:
+            item = (None, None)
+        if item is None:
+            break
+
+        kind, payload = item
+        matches = []
+        try:
+            if kind == ADD:
+                matches = matchmaker.add_users(payload)
+            elif kind == REMOVE:
+                matchmaker.remove_user(payload)
+            elif kind == RESTORE:
+                request_id, tickets = payload
+                replies.put((request_id, shard_id, matchmaker.restore(tickets)))
+            elif kind == SNAPSHOT:
+                request_id, _ = payload
+                replies.put((request_id, shard_id, matchmaker.snapshot()))
+        except Exception:
+            # One bad work item must not take the shard and every player waiting in it down
+            logger.exception(f"Shard {shard_id} failed to apply a '{kind}' work item")
+            if kind in (RESTORE, SNAPSHOT):
+                replies.put((payload[0], shard_id, 0 if kind == RESTORE else []))
+
+        ticked = time.monotonic() >= next_tick
+        if ticked:
+            try:
+                matches.extend(matchmaker.tick())
+            except Exception:
+                logger.exception(f"Shard {shard_id} failed to tick")
+            next_tick = time.monotonic() + tick_interval
+
+        if matches or ticked:
+            sizes = {region: matchmaker.pool_size(region) for region in matchmaker.pools}
+            outbox.put((shard_id, matches, sizes, matchmaker.matches_formed, matchmaker.tickets_expired,
+                        matchmaker.take_expired()))
+
+
+class ShardedMatchmaker:
+    """
+    Routes tickets by region to matchmaking engines in worker processes
+
+    Regions never match each other, so each region runs in its own process
+    and matching scales across CPU cores. Hot regions can be given several
+    shards, each owning an MMR band; players on either side of a band edge
+    are then never matched together. get_user/add_users only route work
+    and return whatever lobbies the workers have reported so far, tick()
+    collects reported lobbies without blocking. A worker that dies is
+    restarted with an empty pool, up to `max_restarts` times per shard.
+    """
+
+    def __init__(self, shard_spec: Optional[str] = None, engine: Optional[str] = None,
+                 tick_interval: Optional[float] = None, max_restarts: Optional[int] = None, **engine_kwargs):
+        counts = parse_shard_spec(shard_spec if shard_spec is not None else os.getenv("MATCHMAKER_SHARDS", ""))
+        mean = float(os.getenv("MMR_MEAN", "2000"))
+        std = float(os.getenv("MMR_STD", "600"))
+        tick_interval = tick_interval or float(os.getenv("MATCHMAKING_TICK_INTERVAL", "0.5"))
+        self.max_restarts = max_restarts if max_restarts is not None else int(os.getenv("SHARD_MAX_RESTARTS", "3"))
+
+        # region -> (band edges, shard id per band)
+        self.routes: Dict[str, Tuple[List[int], List[int]]] = {}
+        shard_count = 0
+        for region, count in counts.items():
+            self.routes[region] = (mmr_band_edges(count, mean, std), list(range(shard_count, shard_count + count)))
+            shard_count += count
+
+        self.lobby_size = engine_kwargs.get("lobby_size") or int(os.getenv("LOBBY_SIZE", "10"))
+        self.matches_formed = 0
+        self.tickets_expired = 0
+        self.expired_users: Deque[str] = deque(maxlen=EXPIRED_BUFFER_SIZE)
+        self._shard_sizes: List[Dict[str, int]] = [{} for _ in range(shard_count)]
+        self._shard_counters: List[Tuple[int, int]] = [(0, 0)] * shard_count
+        # Counters of dead workers, their replacements count from zero again
+        self._retired_counters: Tuple[int, int] = (0, 0)
+        self._restarts = [0] * shard_count
+        self._closing = False
+        self._next_liveness_check = 0.0
+
+        self._context = multiprocessing.get_context("spawn")
+        self._worker_args = (engine, engine_kwargs)
+        self._tick_interval = tick_interval
+        self._outbox = self._context.Queue()
+        # Answers to snapshot and restore requests, tagged with the request id
+        self._replies = self._context.Queue()
+        self._request_ids = itertools.count(1)
+        self._request_lock = threading.Lock()
+        self._inboxes = [self._context.Queue() for _ in range(shard_count)]
+        self._workers = [self._start_worker(shard_id) for shard_id in range(shard_count)]
+        logger.info(f"Started {shard_count} matchmaking shards: {counts}")
+
+    def get_user(self, user_data: Union[PlayerTicket, Dict]) -> List[Dict]:
+        return self.add_users([user_data])
+
+    def add_users(self, users: Iterable[Union[PlayerTicket, Dict]]) -> List[Dict]:
+        batches: Dict[int, List[PlayerTicket]] = {}
+        for user_data in users:
+            ticket = user_data if isinstance(user_data, PlayerTicket) else PlayerTicket.from_dict(user_data)
+            batches.setdefault(self._route(ticket), []).append(ticket)
+        for shard_id, tickets in batches.items():
+            self._inboxes[shard_id].put((ADD, tickets))
+        return self._collect()
+
+    def remove_user(self, user_id: str) -> bool:
+        """Ask every shard to drop the player, the owning shard is not known here"""
+        for inbox in self._inboxes:
+            inbox.put((REMOVE, user_id))
+        return True
+
+    def tick(self, now: Optional[float] = None) -> List[Dict]:
+        """Collect lobbies reported by the shards, each shard ticks on its own clock"""
+        return self._collect()
+
+    def pool_size(self, region: Optional[str] = None) -> int:
+        """Waiting players as last reported by the shards"""
+        return sum(
+            size
+            for sizes in self._shard_sizes
+            for shard_region, size in sizes.items()
+            if region is None or shard_region == region
+        )
+
+    def take_expired(self) -> List[str]:
+        """User ids the shards reported as expired since the last call"""
+        expired = []
+        while self.expired_users:
+            expired.append(self.expired_users.popleft())
+        return expired
+
+    def snapshot(self, timeout: float = 10.0) -> List[PlayerTicket]:
+        """Every player waiting in any shard, gathered from the workers"""
+        replies = self._request(SNAPSHOT, {shard_id: None for shard_id in range(len(self._inboxes))}, timeout)
+        if len(replies) < len(self._inboxes):
+            logger.error("Timed out waiting for shard snapshots, the snapshot is incomplete")
+        return [ticket for shard_tickets in replies.values() for ticket in shard_tickets]
+
+    def restore(self, tickets: Iterable[PlayerTicket], timeout: float = 10.0) -> int:
+        """Route snapshot tickets to their shards, returns how many the shards restored"""
+        batches: Dict[int, List[PlayerTicket]] = {}
+        for ticket in tickets:
+            batches.setdefault(self._route(ticket), []).append(ticket)
+        replies = self._request(RESTORE, batches, timeout)
+        if len(replies) < len(batches):
+            logger.error("Timed out waiting for shards to confirm the restore, the restored count is incomplete")
+        return sum(replies.values())
+
+    def close(self) -> List[Dict]:
+        """Stop the workers, returns the lobbies they reported while shutting down"""
+        self._closing = True
+        for inbox in self._inboxes:
+            inbox.put(None)
+        # Keep draining reports, a worker cannot exit while its results are unread
+        matches = []
+        deadline = time.monotonic() + 5
+        while any(worker.is_alive() for worker in self._workers) and time.monotonic() < deadline:
+            matches.extend(self._collect())
+            time.sleep(0.05)
+        matches.extend(self._collect())
+        for worker in self._workers:
+            if worker.is_alive():
+                worker.terminate()
+            worker.join()
+        if matches:
+            logger.info(f"Collected {len(matches)} lobbies reported during shard shutdown")
+        return matches
+
+    def _request(self, kind: str, payloads: Dict[int, object], timeout: float) -> Dict[int, object]:
+        """
+        Send a request to each shard in `payloads` and wait for their replies by shard id
+
+        Replies carry the request id; late replies to an earlier request that
+        timed out are discarded instead of being taken as answers to this one.
+        """
+        with self._request_lock:
+            request_id = next(self._request_ids)
+            for shard_id, payload in payloads.items():
+                self._inboxes[shard_id].put((kind, (request_id, payload)))
+
+            replies: Dict[int, object] = {}
+            deadline = time.monotonic() + timeout
+            while len(replies) < len(payloads):
+                try:
+                    reply_id, shard_id, result = self._replies.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if reply_id != request_id:
+                    logger.debug(f"Discarding late reply of shard {shard_id} to request {reply_id}")
+                    continue
+                replies[shard_id] = result
+            return replies
+
+    def _start_worker(self, shard_id: int) -> multiprocessing.Process:
+        engine, engine_kwargs = self._worker_args
+        worker = self._context.Process(
+            target=_run_shard,
+            args=(shard_id, engine, engine_kwargs, self._inboxes[shard_id], self._outbox,
+                  self._replies, self._tick_interval),
+            name=f"matchmaking-shard-{shard_id}",
+            daemon=True,
+        )
+        worker.start()
+        return worker
+
+    def _check_workers(self):
+        """Restart shard workers that died, raises once a shard has used up its restarts"""
+        now = time.monotonic()
+        if self._closing or now < self._next_liveness_check:
+            return
+        self._next_liveness_check = now + LIVENESS_CHECK_INTERVAL
+        for shard_id, worker in enumerate(self._workers):
+            if worker.is_alive():
+                continue
+            if self._restarts[shard_id] >= self.max_restarts:
+                raise RuntimeError(f"Matchmaking shard {shard_id} died (exit code {worker.exitcode}) "
+                                   f"after {self._restarts[shard_id]} restarts")
+            self._restarts[shard_id] += 1
+            lost = sum(self._shard_sizes[shard_id].values())
+            logger.error(f"Matchmaking shard {shard_id} died (exit code {worker.exitcode}), restarting it; "
+                         f"about {lost} waiting players were lost")
+            formed, expired = self._shard_counters[shard_id]
+            retired_formed, retired_expired = self._retired_counters
+            self._retired_counters = (retired_formed + formed, retired_expired + expired)
+            self._shard_counters[shard_id] = (0, 0)
+            self._shard_sizes[shard_id] = {}
+            # A process killed mid-read can leave its queue locked, the replacement gets a fresh one
+            self._inboxes[shard_id] = self._context.Queue()
+            self._workers[shard_id] = self._start_worker(shard_id)
+
+    def _route(self, ticket: PlayerTicket) -> int:
+        route = self.routes.get(ticket.region)
+        if route is None:
+            raise ValueError(f"No matchmaking shard for region '{ticket.region}'")
+        edges, shards = route
+        return shards[bisect.bisect_right(edges, ticket.mmr)]
+
+    def _collect(self) -> List[Dict]:
+        matches = []
+        while True:
+            try:
+                shard_id, shard_matches, sizes, formed, expired, expired_users = self._outbox.get_nowait()
+            except queue.Empty:
+                break
+            matches.extend(shard_matches)
+            self.expired_users.extend(expired_users)
+            self._shard_sizes[shard_id] = sizes
+            self._shard_counters[shard_id] = (formed, expired)
+        retired_formed, retired_expired = self._retired_counters
+        self.matches_formed = retired_formed + sum(formed for formed, _ in self._shard_counters)
+        self.tickets_expired = retired_expired + sum(expired for _, expired in self._shard_counters)
+        # After draining, so the last reports of a dead worker are counted before it is replaced
+        self._check_workers()
+        return matches
@@ -0,0 +1,118 @@
+"""
+Hierarchical Timing Wheel
+Schedules per-ticket timer events so only due timers are touched on each tick
+"""
+import math
+from typing import Any, Dict, Hashable, List, Tuple
+
+# Fraction of a tick treated as float error when converting times to ticks
+_EPSILON = 1e-6
+
+
+class TimingWheel:
+    """
+    Hierarchical timing wheel with O(1) schedule and cancel.
+
+    Level 0 has `slots` slots of `resolution` seconds each, every level above
+    covers `slots` times the span of the one below. Timers far in the future
+    sit in a coarse level and cascade down as time approaches their deadline,
+    so advancing the wheel only touches timers that are due (plus an amortised
+    cascade), never the whole set of scheduled timers.
+    """
+
+    def __init__(self, resolution: float = 0.1, slots: int = 64, levels: int = 4, start: float = 0.0):
+        self.resolution = resolution
+        self.slots = slots
+        self.levels = levels
+        self.current_tick = self._tick(start)
+        self._wheels: List[List[Dict[Hashable, Tuple[int, Any]]]] = [
+            [{} for _ in range(slots)] for _ in range(levels)
+        ]
+        # key -> (level, slot) so cancel does not have to search the wheel
+        self._locations: Dict[Hashable, Tuple[int, int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._locations)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._locations
+
+    def schedule(self, key: Hashable, deadline: float, payload: Any = None) -> None:
+        """Schedule (or reschedule) the timer `key` to fire at time `deadline`"""
+        self.cancel(key)
+        deadline_tick = max(self._tick(deadline, round_up=True), self.current_tick + 1)
+        self._place(key, deadline_tick, payload)
+
+    def cancel(self, key: Hashable) -> bool:
+        location = self._locations.pop(key, None)
+        if location is None:
+            return False
+        level, slot = location
+        del self._wheels[level][slot][key]
+        return True
+
+    def advance(self, now: float) -> List[Tuple[Hashable, Any]]:
+        """Move the wheel forward to `now` and return the (key, payload) of due timers"""
+        target_tick = self._tick(now)
+        fired: List[Tuple[Hashable, Any]] = []
+        if not self._locations:
+            self.current_tick = max(self.current_tick, target_tick)
+            return fired
+
+        while self.current_tick < target_tick:
+            self.current_tick += 1
+            tick = self.current_tick
+            self._cascade(tick)
+
+            slot = self._wheels[0][tick % self.slots]
+            if slot:
+                for key, (_, payload) in slot.items():
+                    del self._locations[key]
+                    fired.append((key, payload))
+                slot.clear()
+
+            if not self._locations:
+                self.current_tick = target_tick
+                break
+
+        return fired
+
+    def _tick(self, t: float, round_up: bool = False) -> int:
+        """
+        Tick holding time `t`, or with `round_up` the first tick at or after it
+
+        Both directions share the tolerance, so a deadline that falls on a tick
+        boundary fires when the wheel is advanced to exactly that time instead
+        of one tick later because of float error in the division.
+        """
+        ticks = t / self.resolution
+        return math.ceil(ticks - _EPSILON) if round_up else math.floor(ticks + _EPSILON)
+
+    def _place(self, key: Hashable, deadline_tick: int, payload: Any) -> None:
+        delta = deadline_tick - self.current_tick
+        span = self.slots
+        level = 0
+        while delta >= span and level < self.levels - 1:
+            span *= self.slots
+            level += 1
+        # Beyond the wheel horizon: park in the furthest slot, it is re-placed on cascade
+        placed_tick = min(deadline_tick, self.current_tick + span - 1)
+        slot = (placed_tick // self.slots ** level) % self.slots
+        self._wheels[level][slot][key] = (deadline_tick, payload)
+        self._locations[key] = (level, slot)
+
+    def _cascade(self, tick: int) -> None:
+        """Redistribute coarse-level timers whose slot has just come due"""
+        for level in range(1, self.levels):
+            span = self.slots ** level
+            if tick % span:
+                break
+            slot_index = (tick // span) % self.slots
+            slot = self._wheels[level][slot_index]
+            if not slot:
+                continue
+            entries = list(slot.items())
+            slot.clear()
+            for key, (deadline_tick, payload) in entries:
+                del self._locations[key]
+                self._place(key, max(deadline_tick, tick), payload)
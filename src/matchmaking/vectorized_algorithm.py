@@ -0,0 +1,276 @@
+"""
+Vectorized Matchmaking Algorithm
+Batch matcher over an array-backed player pool, for large regions
+"""
+import os
+import time
+import logging
+import threading
+from collections import deque
+from typing import Deque, List, Dict, Iterable, Optional, Union
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from src.matchmaking.matchmaking_algorithm import EXPIRED_BUFFER_SIZE, make_match
+from src.models.player_ticket import PlayerTicket
+
+logger = logging.getLogger(__name__)
+
+
+class ArrayPool:
+    """
+    Waiting players of one region stored column-wise in NumPy arrays
+
+    Removed players are only flagged dead, the arrays are compacted once
+    more than half of the used rows are dead.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self.mmr = np.zeros(capacity, dtype=np.int32)
+        self.level = np.zeros(capacity, dtype=np.int32)
+        self.enqueued_at = np.zeros(capacity, dtype=np.float64)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.tickets: List[Optional[PlayerTicket]] = [None] * capacity
+        self.rows: Dict[str, int] = {}
+        self.size = 0
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self.rows
+
+    def insert(self, ticket: PlayerTicket) -> bool:
+        if ticket.user_id in self.rows:
+            return False
+        if self.size == len(self.mmr):
+            self._grow()
+        row = self.size
+        self.mmr[row] = ticket.mmr
+        self.level[row] = ticket.level
+        self.enqueued_at[row] = ticket.enqueued_at
+        self.alive[row] = True
+        self.tickets[row] = ticket
+        self.rows[ticket.user_id] = row
+        self.size += 1
+        return True
+
+    def remove(self, user_id: str) -> Optional[PlayerTicket]:
+        row = self.rows.pop(user_id, None)
+        if row is None:
+            return None
+        return self._kill(row)
+
+    def remove_rows(self, rows: np.ndarray) -> List[PlayerTicket]:
+        tickets = [self._kill(row) for row in rows.tolist()]
+        for ticket in tickets:
+            del self.rows[ticket.user_id]
+        return tickets
+
+    def live_rows(self) -> np.ndarray:
+        if self.size > 1024 and len(self.rows) * 2 < self.size:
+            self._compact()
+        return np.flatnonzero(self.alive[:self.size])
+
+    def _kill(self, row: int) -> PlayerTicket:
+        ticket = self.tickets[row]
+        self.alive[row] = False
+        self.tickets[row] = None
+        return ticket
+
+    def _grow(self):
+        capacity = len(self.mmr) * 2
+        for name in ("mmr", "level", "enqueued_at", "alive"):
+            column = getattr(self, name)
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:len(column)] = column
+            setattr(self, name, grown)
+        self.tickets.extend([None] * (capacity - len(self.tickets)))
+
+    def _compact(self):
+        keep = np.flatnonzero(self.alive[:self.size])
+        count = len(keep)
+        for name in ("mmr", "level", "enqueued_at", "alive"):
+            column = getattr(self, name)
+            column[:count] = column[keep]
+            column[count:self.size] = 0
+        tickets = [self.tickets[row] for row in keep.tolist()]
+        self.tickets[:count] = tickets
+        self.tickets[count:self.size] = [None] * (self.size - count)
+        self.rows = {ticket.user_id: row for row, ticket in enumerate(tickets)}
+        self.size = count
+
+
+class VectorizedMatchmakingAlgorithm:
+    """
+    Forms many lobbies per pass with vectorized sort and windowed differences
+
+    Same interface as MatchmakingAlgorithm. Players are only queued by
+    get_user; lobbies are formed by a pass over the whole region in
+    add_users (for the regions it touched) and in tick. A lobby is the
+    `lobby_size` consecutive players in MMR order whose spread fits inside
+    the widest search window of its members, chosen greedily from the
+    lowest MMR upwards. This is the scalar engine's rule with the
+    longest-waiting member as the anchor.
+
+    Windows widen with time waited, computed for the whole pool at once
+    instead of with per-ticket timers. Ties in MMR are broken by a seeded
+    random key, so a pass is deterministic for a given seed, clock and
+    input order.
+    """
+
+    def __init__(self, lobby_size: Optional[int] = None, base_window: Optional[int] = None,
+                 bucket_width: Optional[int] = None, widen_interval: Optional[float] = None,
+                 widen_step: Optional[int] = None, max_window: Optional[int] = None,
+                 max_wait: Optional[float] = None, seed: Optional[int] = None, clock=time.monotonic):
+        self.lobby_size = lobby_size or int(os.getenv("LOBBY_SIZE", "10"))
+        self.base_window = base_window or int(os.getenv("MMR_BASE_WINDOW", "100"))
+        self.widen_interval = widen_interval or float(os.getenv("MMR_WIDEN_INTERVAL", "5"))
+        self.widen_step = widen_step or int(os.getenv("MMR_WIDEN_STEP", "50"))
+        self.max_window = max_window or int(os.getenv("MMR_MAX_WINDOW", "1000"))
+        self.max_wait = max_wait or float(os.getenv("MATCHMAKING_MAX_WAIT", "300"))
+        self.seed = seed
+        self.clock = clock
+        self.pools: Dict[str, ArrayPool] = {}
+        self.matches_formed = 0
+        self.tickets_expired = 0
+        self.expired_users: Deque[str] = deque(maxlen=EXPIRED_BUFFER_SIZE)
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+
+    def get_user(self, user_data: Union[PlayerTicket, Dict]) -> List[Dict]:
+        """Queue a single player, lobbies are formed on the next pass"""
+        with self._lock:
+            self._enqueue(user_data)
+        return []
+
+    def add_users(self, users: Iterable[Union[PlayerTicket, Dict]]) -> List[Dict]:
+        """Queue a batch of players and run a matching pass over the regions it touched"""
+        matches = []
+        with self._lock:
+            touched = {self._enqueue(user_data) for user_data in users}
+            now = self.clock()
+            for region in sorted(touched - {None}):
+                matches.extend(self._match_region(region, now))
+        return matches
+
+    def remove_user(self, user_id: str) -> bool:
+        with self._lock:
+            for pool in self.pools.values():
+                if pool.remove(user_id) is not None:
+                    return True
+        return False
+
+    def tick(self, now: Optional[float] = None) -> List[Dict]:
+        """Run a matching pass over every region, widening and expiring by wait time"""
+        matches = []
+        with self._lock:
+            now = self.clock() if now is None else now
+            for region in sorted(self.pools):
+                matches.extend(self._match_region(region, now))
+        return matches
+
+    def pool_size(self, region: Optional[str] = None) -> int:
+        if region is not None:
+            pool = self.pools.get(region)
+            return len(pool) if pool else 0
+        return sum(len(pool) for pool in self.pools.values())
+
+    def take_expired(self) -> List[str]:
+        """User ids of players expired since the last call, for the consumer to forget their claims"""
+        with self._lock:
+            expired = list(self.expired_users)
+            self.expired_users.clear()
+        return expired
+
+    def snapshot(self) -> List[PlayerTicket]:
+        """Every waiting player, for writing a pool snapshot"""
+        with self._lock:
+            return [pool.tickets[row] for pool in self.pools.values() for row in pool.rows.values()]
+
+    def restore(self, tickets: Iterable[PlayerTicket]) -> int:
+        """
+        Queue players from a pool snapshot, keeping their wait
+
+        Tickets must already carry `enqueued_at` on this engine's clock, the
+        search window follows from it on the next pass. Players that are
+        already waiting are skipped.
+        """
+        restored = 0
+        with self._lock:
+            for ticket in tickets:
+                pool = self.pools.get(ticket.region)
+                if pool is None:
+                    pool = self.pools[ticket.region] = ArrayPool()
+                if pool.insert(ticket):
+                    restored += 1
+        return restored
+
+    def close(self) -> List[Dict]:
+        """Nothing to release or drain, present for interface parity with ShardedMatchmaker"""
+        return []
+
+    def _enqueue(self, user_data: Union[PlayerTicket, Dict]) -> Optional[str]:
+        if isinstance(user_data, PlayerTicket):
+            ticket = user_data
+        else:
+            ticket = PlayerTicket.from_dict(user_data)
+        ticket.enqueued_at = self.clock()
+        ticket.window = self.base_window
+
+        pool = self.pools.get(ticket.region)
+        if pool is None:
+            pool = self.pools[ticket.region] = ArrayPool()
+        if not pool.insert(ticket):
+            logger.debug(f"User {ticket.user_id} is already waiting")
+            return None
+        return ticket.region
+
+    def _match_region(self, region: str, now: float) -> List[Dict]:
+        pool = self.pools[region]
+        rows = pool.live_rows()
+
+        wait = now - pool.enqueued_at[rows]
+        expired = wait >= self.max_wait
+        if expired.any():
+            self.tickets_expired += int(expired.sum())
+            self.expired_users.extend(ticket.user_id for ticket in pool.remove_rows(rows[expired]))
+            rows = rows[~expired]
+            wait = wait[~expired]
+
+        size = self.lobby_size
+        if len(rows) < size:
+            return []
+
+        windows = np.minimum(
+            self.base_window + (wait // self.widen_interval).astype(np.int64) * self.widen_step,
+            self.max_window,
+        )
+        mmr = pool.mmr[rows]
+        order = np.lexsort((self._rng.random(len(rows)), mmr))
+        sorted_mmr = mmr[order]
+
+        # Spread of every run of `size` consecutive players, against the widest window in the run
+        spreads = sorted_mmr[size - 1:] - sorted_mmr[:len(sorted_mmr) - size + 1]
+        allowed = sliding_window_view(windows[order], size).max(axis=1)
+        candidates = np.flatnonzero(spreads <= allowed)
+        if not len(candidates):
+            return []
+
+        # Greedy leftmost choice of non-overlapping runs
+        starts = []
+        next_free = 0
+        for start in candidates.tolist():
+            if start >= next_free:
+                starts.append(start)
+                next_free = start + size
+
+        sorted_rows = rows[order]
+        sorted_windows = windows[order]
+        matches = []
+        for start in starts:
+            players = pool.remove_rows(sorted_rows[start:start + size])
+            for player, window in zip(players, sorted_windows[start:start + size].tolist()):
+                player.window = window
+            matches.append(make_match(region, players))
+        self.matches_formed += len(matches)
+        return matches
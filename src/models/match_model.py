@@ -0,0 +1,28 @@
+"""
+Match Model - lobbies formed by the matchmaker
+"""
+from sqlalchemy import Column, String, Integer, DateTime, Index
+from sqlalchemy.dialects.postgresql import ARRAY
+from datetime import datetime
+from src.clients.database import Base
+
+
+class MatchModel(Base):
+    """Database model for formed matches"""
+    __tablename__ = 'matches'
+
+    match_id = Column(String(36), primary_key=True)
+    region = Column(String(50), nullable=False)
+    avg_mmr = Column(Integer, nullable=False)
+    mmr_spread = Column(Integer, nullable=False)
+    player_ids = Column(ARRAY(String(255)), nullable=False)
+    created_at = Column(DateTime, default=datetime.now, nullable=False)
+
+    __table_args__ = (
+        Index('idx_matches_region', 'region'),
+        Index('idx_matches_created_at', 'created_at'),
+    )
+
+    def __repr__(self) -> str:
+        """String representation for logging"""
+        return f"Match[{self.match_id}, Region={self.region}, Players={len(self.player_ids or [])}]"
@@ -0,0 +1,81 @@
+"""
+Player Ticket - lightweight matchmaking queue entry
+Plain __slots__ object used on the matchmaking hot path instead of the ORM model
+"""
+import uuid
+from typing import Dict, Optional
+from src.models.user_model import UserModel
+from src.models.wire_format import (
+    BINARY_VERSION, ENCODING_ATTRIBUTE, ENCODING_BINARY, REGION_NAMES, TICKET_STRUCT, decode_user
+)
+
+
+class PlayerTicket:
+    """
+    A waiting player as seen by the matchmaker
+
+    No SQLAlchemy instrumentation and no per-instance __dict__, so attribute
+    access is a plain slot read and millions of waiting players have a
+    predictable memory footprint. `window` is the current MMR search window
+    and is owned by the matchmaker.
+    """
+    __slots__ = ("user_id", "mmr", "region", "level", "games_played", "enqueued_at", "window")
+
+    def __init__(self, user_id: str, mmr: int, region: str, level: int = 1,
+                 games_played: int = 0, enqueued_at: float = 0.0, window: int = 0):
+        self.user_id = user_id
+        self.mmr = mmr
+        self.region = region
+        self.level = level
+        self.games_played = games_played
+        self.enqueued_at = enqueued_at
+        self.window = window
+
+    @classmethod
+    def from_dict(cls, data: Dict, enqueued_at: float = 0.0) -> "PlayerTicket":
+        region = data["region"]
+        return cls(
+            user_id=str(data["user_id"]),
+            mmr=int(data["mmr"]),
+            region=region if isinstance(region, str) else region.value,
+            level=data.get("level") or 1,
+            games_played=data.get("games_played") or 0,
+            enqueued_at=enqueued_at,
+        )
+
+    @classmethod
+    def from_user_model(cls, user: UserModel, enqueued_at: float = 0.0) -> "PlayerTicket":
+        return cls(
+            user_id=str(user.user_id),
+            mmr=user.mmr,
+            region=user.region if isinstance(user.region, str) else user.region.value,
+            level=user.level or 1,
+            games_played=user.games_played or 0,
+            enqueued_at=enqueued_at,
+        )
+
+    @classmethod
+    def from_wire(cls, payload: bytes, attributes: Optional[Dict[str, str]] = None,
+                  enqueued_at: float = 0.0) -> "PlayerTicket":
+        """Build a ticket straight from a message payload"""
+        if (attributes or {}).get(ENCODING_ATTRIBUTE) == ENCODING_BINARY:
+            # Unpack directly into the ticket, skipping the intermediate dict
+            version, user_id, region, mmr, games_played, level, _ = TICKET_STRUCT.unpack(payload)
+            if version != BINARY_VERSION:
+                raise ValueError(f"Unsupported binary ticket version {version}")
+            return cls(str(uuid.UUID(bytes=user_id)), mmr, REGION_NAMES.get(region, "Unknown"),
+                       level, games_played, enqueued_at)
+        return cls.from_dict(decode_user(payload, attributes), enqueued_at)
+
+    def to_dict(self) -> Dict:
+        return {
+            "user_id": self.user_id,
+            "mmr": self.mmr,
+            "region": self.region,
+            "level": self.level,
+            "games_played": self.games_played,
+            "enqueued_at": self.enqueued_at,
+        }
+
+    def __repr__(self) -> str:
+        return f"Ticket[{self.user_id}, MMR={self.mmr}, Region={self.region}]"
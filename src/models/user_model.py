@@ -44,9 +44,9 @@ class UserModel(Base):
         Index('idx_ingame', 'ingame'),
     )
 
-    def to_json(self) -> str:
-        """Serialize user to JSON string for Kafka"""
-        data = {
+    def to_dict(self) -> dict:
+        """Plain dict of the fields sent over the wire"""
+        return {
             "user_id": self.user_id,
             "mmr": self.mmr,
             "region": self.region if isinstance(self.region, str) else self.region.value,
@@ -54,7 +54,10 @@ class UserModel(Base):
             "level": self.level,
             "ingame": self.ingame
         }
-        return json.dumps(data)
+
+    def to_json(self) -> str:
+        """Serialize user to JSON string for Kafka"""
+        return json.dumps(self.to_dict())
 
     @classmethod
     def from_json(cls, json_str: str) -> "UserModel":
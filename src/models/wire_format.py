@@ -0,0 +1,138 @@
+"""
+Wire Format - encodings for player tickets sent through Pub/Sub
+JSON stays the default and fallback, the binary layout is a fixed struct
+"""
+import json
+import struct
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple, Union
+from src.models.user_model import UserModel, Region
+
+# Message attribute used by publisher and consumer to agree on the payload encoding.
+# Messages without it are JSON, so older publishers keep working.
+ENCODING_ATTRIBUTE = "encoding"
+ENCODING_JSON = "json"
+ENCODING_BINARY = "bin1"
+# Thin messages carry only the user_id attribute and a profile version, the
+# consumer resolves the profile from the users table
+ENCODING_THIN = "thin1"
+ENCODINGS = (ENCODING_JSON, ENCODING_BINARY, ENCODING_THIN)
+USER_ID_ATTRIBUTE = "user_id"
+# Set once per queued ticket by the publisher, so a redelivery or a publish retry of a
+# ticket keeps it while the same player queueing again gets a new one
+TICKET_ID_ATTRIBUTE = "ticket_id"
+
+BINARY_VERSION = 1
+
+# version, user_id (binary UUID), region code, mmr, games_played, level, flags
+TICKET_STRUCT = struct.Struct("<B16sBHIHB")
+FLAG_INGAME = 0x01
+
+# version, profile version (users.updated_at in milliseconds, see profile_version)
+THIN_STRUCT = struct.Struct("<BQ")
+
+# Region enum byte, 0 is reserved for "unknown". Aliases share a value, so only
+# canonical members are listed and the order must never change.
+REGION_CODES: Dict[str, int] = {region.value: code for code, region in enumerate(Region, start=1)}
+REGION_NAMES: Dict[int, str] = {code: name for name, code in REGION_CODES.items()}
+
+
+def user_to_dict(user: Union[UserModel, Dict]) -> Dict:
+    """Flatten a UserModel (or pass through a dict) into the wire fields"""
+    return user if isinstance(user, dict) else user.to_dict()
+
+
+def encode_binary(data: Dict) -> bytes:
+    """Pack a user into the fixed binary layout, raises ValueError if it does not fit"""
+    region = data["region"] if isinstance(data["region"], str) else data["region"].value
+    try:
+        return TICKET_STRUCT.pack(
+            BINARY_VERSION,
+            uuid.UUID(str(data["user_id"])).bytes,
+            REGION_CODES[region],
+            data["mmr"],
+            data.get("games_played") or 0,
+            data.get("level") or 1,
+            FLAG_INGAME if data.get("ingame") else 0,
+        )
+    except (KeyError, struct.error) as e:
+        raise ValueError(f"User {data.get('user_id')} cannot be binary encoded: {e}")
+
+
+def decode_binary(payload: bytes) -> Dict:
+    """Unpack the fixed binary layout into a plain dict (no ORM instance)"""
+    version, user_id, region, mmr, games_played, level, flags = TICKET_STRUCT.unpack(payload)
+    if version != BINARY_VERSION:
+        raise ValueError(f"Unsupported binary ticket version {version}")
+    return {
+        "user_id": str(uuid.UUID(bytes=user_id)),
+        "mmr": mmr,
+        "region": REGION_NAMES.get(region, "Unknown"),
+        "games_played": games_played,
+        "level": level,
+        "ingame": bool(flags & FLAG_INGAME),
+    }
+
+
+def profile_version(updated_at: Optional[datetime]) -> int:
+    """
+    Version of a player profile, derived from its users.updated_at value
+
+    The column is a naive timestamp written in the writer's local time, so
+    the version is only compared, never read as a point in time. Naive values
+    are converted as if they were UTC instead of in the host's timezone, so
+    publishers and consumers on differently configured hosts agree.
+    """
+    if not updated_at:
+        return 0
+    if updated_at.tzinfo is None:
+        updated_at = updated_at.replace(tzinfo=timezone.utc)
+    return int(updated_at.timestamp() * 1000)
+
+
+def encode_thin(user: Union[UserModel, Dict]) -> bytes:
+    """Pack the profile version of a user, the user_id travels as a message attribute"""
+    updated_at = user.get("updated_at") if isinstance(user, dict) else user.updated_at
+    return THIN_STRUCT.pack(BINARY_VERSION, profile_version(updated_at))
+
+
+def decode_thin(payload: bytes, attributes: Dict[str, str]) -> Tuple[str, int]:
+    """Return the (user_id, profile version) a thin message refers to"""
+    version, profile = THIN_STRUCT.unpack(payload)
+    if version != BINARY_VERSION:
+        raise ValueError(f"Unsupported thin ticket version {version}")
+    user_id = attributes.get(USER_ID_ATTRIBUTE)
+    if not user_id:
+        raise ValueError("Thin message without a user_id attribute")
+    return user_id, profile
+
+
+def encode_user(user: Union[UserModel, Dict], encoding: str = ENCODING_JSON) -> Tuple[bytes, str]:
+    """
+    Encode a user for publishing
+
+    Returns the payload and the encoding actually used. Users that do not fit
+    the binary layout (non-UUID ids, unknown regions) fall back to JSON.
+    """
+    if encoding == ENCODING_THIN:
+        return encode_thin(user), ENCODING_THIN
+    data = user_to_dict(user)
+    if encoding == ENCODING_BINARY:
+        try:
+            return encode_binary(data), ENCODING_BINARY
+        except ValueError:
+            pass
+    return json.dumps(data).encode("utf-8"), ENCODING_JSON
+
+
+def decode_user(payload: bytes, attributes: Optional[Dict[str, str]] = None) -> Dict:
+    """Decode a message payload according to its encoding attribute"""
+    encoding = (attributes or {}).get(ENCODING_ATTRIBUTE, ENCODING_JSON)
+    if encoding == ENCODING_BINARY:
+        return decode_binary(payload)
+    if encoding == ENCODING_THIN:
+        raise ValueError("Thin messages carry no profile, resolve them through the player cache")
+    if encoding != ENCODING_JSON:
+        raise ValueError(f"Unknown message encoding: {encoding}")
+    return json.loads(payload.decode("utf-8"))
@@ -0,0 +1,346 @@
+"""
+Matchmaking Benchmark
+Throughput, time-to-match, lobby MMR spread and peak RSS as JSON
+
+Usage: python -m src.scripts.benchmark --output results.json [--baseline previous.json]
+
+Algorithm scenarios drive an engine directly on a virtual clock: arrival
+times and wait-based widening are simulated, only the matchmaker calls are
+timed. Consumer scenarios run MatchmakingConsumer over the in-memory
+transport on the wall clock. Every scenario runs in a fresh process so its
+peak RSS is its own. Players come from data_gen.generate_player with a
+fixed seed, so runs on different commits see identical input.
+"""
+import os
+import sys
+import json
+import time
+import queue
+import random
+import logging
+import platform
+import resource
+import threading
+import subprocess
+import multiprocessing
+from datetime import datetime
+from typing import Dict, List
+
+from src.matchmaking.engines import create_matchmaker
+from src.models.player_ticket import PlayerTicket
+from src.scripts.data_gen import generate_player
+from src.simulator.load_generator import percentile
+from src.simulator.simulation import VirtualClock
+from src.telemetry.logging_setup import configure_logging
+
+logger = logging.getLogger(__name__)
+
+# Widening/expiry timer interval on the virtual clock, same default as the consumer
+TICK_INTERVAL = 0.5
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _summarize(waits: List[float], spreads: List[int]) -> Dict:
+    return {
+        "time_to_match_p50": round(percentile(waits, 0.5), 4),
+        "time_to_match_p99": round(percentile(waits, 0.99), 4),
+        "spread_mean": round(sum(spreads) / len(spreads), 2) if spreads else 0.0,
+        "spread_p50": percentile(spreads, 0.5),
+        "spread_p99": percentile(spreads, 0.99),
+        "spread_max": max(spreads, default=0),
+    }
+
+
+def run_algorithm(engine: str, pool_size: int, rate: float, duration: float, seed: int) -> Dict:
+    """
+    Prefill `pool_size` players, then Poisson arrivals at `rate`/s for `duration` simulated seconds
+
+    Arrivals are handed to add_users once per tick interval, followed by
+    tick(), which is how the batched consumer drives the engine. Time to
+    match is measured on the virtual clock from arrival to the lobby, for
+    arrivals only; prefilled players are warm-up.
+    """
+    random.seed(seed)
+    prefill = [PlayerTicket.from_dict(generate_player()) for _ in range(pool_size)]
+    arrivals = []
+    now = random.expovariate(rate) if rate > 0 else duration
+    while now < duration:
+        arrivals.append((now, PlayerTicket.from_dict(generate_player())))
+        now += random.expovariate(rate)
+
+    clock = VirtualClock()
+    matchmaker = create_matchmaker(engine, sharded=False, seed=seed, clock=clock)
+    arrived_at: Dict[str, float] = {}
+    waits: List[float] = []
+    spreads: List[int] = []
+
+    def record(matches):
+        for match in matches:
+            spreads.append(match["mmr_spread"])
+            for player in match["players"]:
+                arrival = arrived_at.pop(player.user_id, None)
+                if arrival is not None:
+                    waits.append(clock.now - arrival)
+
+    started = time.perf_counter()
+    matchmaker.add_users(prefill)
+    prefill_seconds = time.perf_counter() - started
+    spreads.clear()
+
+    started = time.perf_counter()
+    index = 0
+    step = 0
+    while clock.now < duration:
+        step += 1
+        step_end = step * TICK_INTERVAL
+        batch = []
+        while index < len(arrivals) and arrivals[index][0] < step_end:
+            arrival, ticket = arrivals[index]
+            arrived_at[ticket.user_id] = arrival
+            batch.append(ticket)
+            index += 1
+        clock.now = step_end
+        if batch:
+            record(matchmaker.add_users(batch))
+        record(matchmaker.tick(step_end))
+    elapsed = time.perf_counter() - started
+    matchmaker.close()
+
+    return {
+        "engine": engine,
+        "pool_size": pool_size,
+        "rate": rate,
+        "duration": duration,
+        "tickets": len(arrivals),
+        "matched": len(waits),
+        "matches": len(spreads),
+        "expired": matchmaker.tickets_expired,
+        "final_pool": matchmaker.pool_size(),
+        "prefill_seconds": round(prefill_seconds, 4),
+        "wall_seconds": round(elapsed, 4),
+        "tickets_per_sec": round(len(arrivals) / elapsed, 1) if elapsed > 0 else 0.0,
+        **_summarize(waits, spreads),
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def run_consumer(engine: str, batch_mode: bool, rate: float, duration: float, seed: int) -> Dict:
+    """
+    Publish at `rate`/s for `duration` seconds into a consumer on the in-memory transport
+
+    A rate of 0 publishes as fast as possible. Time to match is wall time
+    from publish to the balanced lobby being submitted for persistence; tickets/sec
+    is consumed messages over the time until the last one was processed.
+    """
+    from src.matchmaking.consumer import MatchmakingConsumer
+    from src.matchmaking.match_persister import MatchPersister
+    from src.models.user_model import UserModel
+    from src.simulator.publisher import MatchmakingPublisher
+
+    # Publisher and consumer share the in-process broker, no network in the measurement
+    os.environ["MATCHMAKING_TRANSPORT"] = "memory"
+    os.environ["MATCHMAKER_ENGINE"] = engine
+    random.seed(seed)
+    count = int(rate * duration) if rate > 0 else int(duration * 10000)
+    users = [UserModel(**generate_player()) for _ in range(count)]
+
+    published_at: Dict[str, float] = {}
+    waits: List[float] = []
+    spreads: List[int] = []
+    lock = threading.Lock()
+
+    class BenchmarkPersister(MatchPersister):
+        """Records lobbies as they are handed over, the buffering and writer thread stay real"""
+        uses_database = False
+
+        def submit(self, match):
+            now = time.monotonic()
+            with lock:
+                spreads.append(match["mmr_spread"])
+                for player in match["players"]:
+                    sent = published_at.pop(player.user_id, None)
+                    if sent is not None:
+                        waits.append(now - sent)
+            return super().submit(match)
+
+        def _flush(self, batch):
+            self.persisted += len(batch)
+            return True
+
+    # Team balancing and the persister's buffer are measured, only the database write is left out
+    consumer = MatchmakingConsumer(batch_mode=batch_mode, persister=BenchmarkPersister())
+    consumer_thread = threading.Thread(target=consumer.start, name="consumer", daemon=True)
+    consumer_thread.start()
+    publisher = MatchmakingPublisher()
+    publisher.connect()
+
+    started = time.monotonic()
+    for i, user in enumerate(users):
+        if rate > 0:
+            delay = started + i / rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        with lock:
+            published_at[user.user_id] = time.monotonic()
+        publisher.publish_user_async(user)
+
+    deadline = time.monotonic() + 60
+    while consumer.messages_processed < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+    elapsed = time.monotonic() - started
+    consumed = consumer.messages_processed
+    consumer.stop()
+    consumer_thread.join(timeout=10)
+    publisher.close()
+
+    return {
+        "engine": engine,
+        "batch_mode": batch_mode,
+        "rate": rate,
+        "duration": duration,
+        "tickets": count,
+        "consumed": consumed,
+        "matched": len(waits),
+        "matches": len(spreads),
+        "final_pool": consumer.matchmaker.pool_size(),
+        "wall_seconds": round(elapsed, 4),
+        "tickets_per_sec": round(consumed / elapsed, 1) if elapsed > 0 else 0.0,
+        **_summarize(waits, spreads),
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def _run_scenario(kind: str, kwargs: Dict, results: multiprocessing.Queue):
+    logging.getLogger().setLevel(logging.WARNING)
+    runner = run_algorithm if kind == "algorithm" else run_consumer
+    results.put(runner(**kwargs))
+
+
+def run_isolated(kind: str, **kwargs) -> Dict:
+    """Run one scenario in a fresh process so peak RSS is not shared between scenarios"""
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    worker = context.Process(target=_run_scenario, args=(kind, kwargs, results))
+    worker.start()
+    while True:
+        try:
+            result = results.get(timeout=1)
+            break
+        except queue.Empty:
+            if not worker.is_alive():
+                raise RuntimeError(f"Benchmark scenario {kind} {kwargs} failed (exit code {worker.exitcode})")
+    worker.join()
+    return result
+
+
+def scenario_name(kind: str, result: Dict) -> str:
+    if kind == "algorithm":
+        return f"algorithm/{result['engine']}/pool={result['pool_size']}/rate={result['rate']:g}"
+    mode = "batch" if result["batch_mode"] else "single"
+    return f"consumer/{result['engine']}/{mode}/rate={result['rate']:g}"
+
+
+def environment(seed: int) -> Dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except Exception:
+        commit = None
+    return {
+        "commit": commit,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "seed": seed,
+        "tick_interval": TICK_INTERVAL,
+    }
+
+
+def compare(results: List[Dict], baseline: Dict, tolerance: float) -> List[str]:
+    """Scenarios whose throughput dropped or p99 time to match grew by more than `tolerance`"""
+    previous = {result["name"]: result for result in baseline.get("results", [])}
+    regressions = []
+    for result in results:
+        old = previous.get(result["name"])
+        if not old:
+            continue
+        if result["tickets_per_sec"] < old["tickets_per_sec"] * (1 - tolerance):
+            regressions.append(
+                f"{result['name']}: tickets/sec {old['tickets_per_sec']} -> {result['tickets_per_sec']}"
+            )
+        if result["time_to_match_p99"] > old["time_to_match_p99"] * (1 + tolerance) + 0.001:
+            regressions.append(
+                f"{result['name']}: p99 time to match {old['time_to_match_p99']} -> {result['time_to_match_p99']}"
+            )
+    return regressions
+
+
+def _csv(cast):
+    return lambda value: [cast(item) for item in value.split(",") if item]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    configure_logging()
+    parser = argparse.ArgumentParser(description="Benchmark matchmaking throughput, latency and match quality")
+    parser.add_argument("--engines", type=_csv(str), default=["scalar", "vectorized"])
+    parser.add_argument("--pool-sizes", type=_csv(int), default=[0, 20000],
+                        help="Players already waiting before arrivals start (default: 0,20000)")
+    parser.add_argument("--rates", type=_csv(float), default=[200.0, 2000.0],
+                        help="Arrival rates in tickets per simulated second (default: 200,2000)")
+    parser.add_argument("--duration", type=float, default=120.0, help="Simulated seconds of arrivals (default: 120)")
+    parser.add_argument("--consumer", action="store_true", help="Also benchmark MatchmakingConsumer end to end")
+    parser.add_argument("--consumer-rates", type=_csv(float), default=[0.0],
+                        help="Publish rates in messages per second, 0 for as fast as possible (default: 0)")
+    parser.add_argument("--consumer-duration", type=float, default=5.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=None, help="Write JSON results here instead of stdout")
+    parser.add_argument("--baseline", default=None, help="Earlier JSON results to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed relative regression (default: 0.1)")
+    args = parser.parse_args()
+
+    results = []
+    for engine in args.engines:
+        for pool_size in args.pool_sizes:
+            for rate in args.rates:
+                result = run_isolated("algorithm", engine=engine, pool_size=pool_size, rate=rate,
+                                      duration=args.duration, seed=args.seed)
+                result["name"] = scenario_name("algorithm", result)
+                logger.info(f"{result['name']}: {result['tickets_per_sec']} tickets/s, "
+                            f"p99 wait {result['time_to_match_p99']}s, p99 spread {result['spread_p99']}")
+                results.append(result)
+
+    if args.consumer:
+        for engine in args.engines:
+            for batch_mode in (False, True):
+                for rate in args.consumer_rates:
+                    result = run_isolated("consumer", engine=engine, batch_mode=batch_mode, rate=rate,
+                                          duration=args.consumer_duration, seed=args.seed)
+                    result["name"] = scenario_name("consumer", result)
+                    logger.info(f"{result['name']}: {result['tickets_per_sec']} tickets/s, "
+                                f"p99 wait {result['time_to_match_p99']}s, p99 spread {result['spread_p99']}")
+                    results.append(result)
+
+    report = {"environment": environment(args.seed), "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"Wrote {len(results)} results to {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            logger.warning(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
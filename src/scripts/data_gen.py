@@ -4,11 +4,17 @@ Generates realistic user data and writes directly to PostgreSQL database
 
 Usage: python -m src.scripts.data_gen
 """
+import io
 import uuid
 import random
 import sys
-from sqlalchemy import func
-from src.clients.database import connect_db, init_db, get_session
+import time
+import multiprocessing
+from datetime import datetime
+import numpy as np
+from sqlalchemy import insert, text
+from src.clients.database import connect_db, close_db, init_db, get_session
+from src.clients import database
 from src.models.user_model import UserModel, Region
 from dotenv import load_dotenv
 
@@ -53,6 +59,145 @@ def generate_player() -> dict:
     }
 
 
+def generate_player_columns(count: int, rng: np.random.Generator) -> dict:
+    """
+    Generate `count` players at once as column arrays
+
+    Same distributions as generate_player, drawn with NumPy in one call per
+    column instead of one Python call per player.
+    """
+    mmr = np.clip(rng.normal(2000, 600, count).astype(np.int64), 0, 5000)
+    games_played = np.maximum(rng.normal(mmr / 10, 20).astype(np.int64), 0)
+    region_index = rng.choice(len(regions), size=count, p=region_weights)
+    level = np.maximum((games_played / 15 + rng.integers(-3, 6, count)).astype(np.int64), 1)
+
+    raw_ids = rng.bytes(16 * count)
+    user_ids = [str(uuid.UUID(bytes=raw_ids[i:i + 16], version=4)) for i in range(0, 16 * count, 16)]
+    region_names = np.array([region.value for region in regions])[region_index]
+
+    return {
+        "user_id": user_ids,
+        "mmr": mmr,
+        "games_played": games_played,
+        "region": region_names,
+        "level": level,
+    }
+
+
+def _columns_to_csv(columns: dict) -> io.BytesIO:
+    """Render generated columns as CSV rows for COPY"""
+    now = datetime.now().isoformat(sep=" ")
+    rows = zip(columns["user_id"], columns["mmr"].tolist(), columns["region"].tolist(),
+               columns["games_played"].tolist(), columns["level"].tolist())
+    body = "".join(
+        f"{user_id},{mmr},{region},{games},{level},f,{now},{now}\n"
+        for user_id, mmr, region, games, level in rows
+    )
+    return io.BytesIO(body.encode("utf-8"))
+
+
+def _columns_to_rows(columns: dict) -> list:
+    """Render generated columns as parameter dicts for a multi-row INSERT"""
+    now = datetime.now()
+    return [
+        {"user_id": user_id, "mmr": mmr, "region": region, "games_played": games,
+         "level": level, "ingame": False, "created_at": now, "updated_at": now}
+        for user_id, mmr, region, games, level in zip(
+            columns["user_id"], columns["mmr"].tolist(), columns["region"].tolist(),
+            columns["games_played"].tolist(), columns["level"].tolist())
+    ]
+
+
+def _load_chunks(worker_id: int, chunks: int, chunk_size: int, method: str, seed) -> int:
+    """Worker process: generate and bulk load `chunks` chunks, returns rows inserted"""
+    if not connect_db():
+        raise RuntimeError(f"Worker {worker_id} could not connect to the database")
+    rng = np.random.default_rng(None if seed is None else [seed, worker_id])
+    inserted = 0
+    try:
+        for _ in range(chunks):
+            columns = generate_player_columns(chunk_size, rng)
+            if method == "copy":
+                conn = database.engine.raw_connection()
+                try:
+                    cursor = conn.cursor()
+                    cursor.execute(
+                        "COPY users (user_id, mmr, region, games_played, level, ingame, created_at, updated_at) "
+                        "FROM STDIN WITH (FORMAT csv)",
+                        stream=_columns_to_csv(columns),
+                    )
+                    conn.commit()
+                finally:
+                    conn.close()
+            else:
+                with database.engine.begin() as conn:
+                    conn.execute(insert(UserModel.__table__), _columns_to_rows(columns))
+            inserted += chunk_size
+            print(f" Worker {worker_id}: inserted {inserted} players...")
+    finally:
+        close_db()
+    return inserted
+
+
+def populate_database_fast(num_players: int = NUM_PLAYERS, workers: int = 4,
+                           chunk_size: int = 50000, method: str = "copy", seed=None):
+    """
+    Generate players in vectorized chunks and bulk load them from several processes
+
+    Args:
+        num_players: Number of players to generate
+        workers: Number of loader processes, each with its own connection
+        chunk_size: Players generated and loaded per round trip
+        method: "copy" for PostgreSQL COPY, "executemany" for multi-row INSERT
+        seed: Optional seed for reproducible data
+    """
+    print("=" * 60)
+    print("DATA GENERATION (BULK)")
+    print("=" * 60)
+    print(f"Generating {num_players} players with {workers} workers "
+          f"({method}, {chunk_size} rows per chunk)...")
+
+    chunk_size = max(1, min(chunk_size, num_players))
+    total_chunks, remainder = divmod(num_players, chunk_size)
+    plan = [(worker_id, total_chunks // workers + (1 if worker_id < total_chunks % workers else 0))
+            for worker_id in range(workers)]
+
+    started = time.perf_counter()
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(workers) as pool:
+        results = [pool.apply_async(_load_chunks, (worker_id, chunks, chunk_size, method, seed))
+                   for worker_id, chunks in plan if chunks]
+        if remainder:
+            results.append(pool.apply_async(_load_chunks, (workers, 1, remainder, method, seed)))
+        inserted = sum(result.get() for result in results)
+    elapsed = time.perf_counter() - started
+
+    print(f"\nSUCCESS: Inserted {inserted} players in {elapsed:.1f}s ({inserted / elapsed:,.0f} rows/s)")
+
+    session = get_session()
+    print_statistics(session, inserted)
+    session.close()
+    return True
+
+
+def print_statistics(session, inserted: int):
+    """Per-region counts and average MMR from a single GROUP BY pass"""
+    rows = session.execute(
+        text("SELECT region, COUNT(*), AVG(mmr) FROM users GROUP BY region ORDER BY COUNT(*) DESC")
+    ).all()
+
+    print("\nDatabase Statistics:")
+    total = sum(count for _, count, _ in rows)
+    for region, count, _ in rows:
+        percentage = (count / inserted * 100) if inserted > 0 else 0
+        print(f"  {region:10s}: {count:4d} players ({percentage:.1f}%)")
+
+    if total:
+        avg_mmr = sum(float(avg) * count for _, count, avg in rows) / total
+        print(f"\nAverage MMR: {avg_mmr:.0f}")
+    print("=" * 60)
+
+
 def populate_database(num_players: int = NUM_PLAYERS, batch_size: int = 100):
     """
     Generate synthetic players and insert them into the database
@@ -94,16 +239,7 @@ def populate_database(num_players: int = NUM_PLAYERS, batch_size: int = 100):
 
     print(f"\nSUCCESS: Inserted {inserted} players into the database!")
 
-    # Show statistics
-    print("\nDatabase Statistics:")
-    for region in regions:
-        count = session.query(UserModel).filter(UserModel.region == region.value).count()
-        percentage = (count / inserted * 100) if inserted > 0 else 0
-        print(f"  {region.value:10s}: {count:4d} players ({percentage:.1f}%)")
-
-    avg_mmr = session.query(func.avg(UserModel.mmr)).scalar()
-    print(f"\nAverage MMR: {avg_mmr:.0f}")
-    print("=" * 60)
+    print_statistics(session, inserted)
 
     session.close()
 
@@ -144,6 +280,20 @@ if __name__ == "__main__":
         action="store_true",
         help="Only clear the database, don't generate new data"
     )
+    parser.add_argument(
+        "--bulk",
+        action="store_true",
+        help="Vectorized generation with parallel bulk loading (for millions of players)"
+    )
+    parser.add_argument("--workers", type=int, default=4, help="Bulk loader processes (default: 4)")
+    parser.add_argument("--chunk-size", type=int, default=50000, help="Rows per bulk chunk (default: 50000)")
+    parser.add_argument(
+        "--method",
+        choices=["copy", "executemany"],
+        default="copy",
+        help="Bulk load method (default: copy)"
+    )
+    parser.add_argument("--seed", type=int, default=None, help="Seed for reproducible bulk data")
 
     args = parser.parse_args()
 
@@ -160,7 +310,16 @@ if __name__ == "__main__":
             sys.exit(0)
 
     # Generate and populate database
-    success = populate_database(num_players=args.players)
+    if args.bulk:
+        success = populate_database_fast(
+            num_players=args.players,
+            workers=args.workers,
+            chunk_size=args.chunk_size,
+            method=args.method,
+            seed=args.seed
+        )
+    else:
+        success = populate_database(num_players=args.players)
 
     if not success:
         sys.exit(1)
@@ -5,6 +5,7 @@ print("=" * 60)
 print("Testing Cloud SQL connection...")
 from src.clients.database import connect_db, close_db, init_db
 from src.models.user_model import UserModel  # Import models so they're registered with Base
+from src.models.match_model import MatchModel
 
 if connect_db():
     print("SUCCESS: Database connection established!")
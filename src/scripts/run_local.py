@@ -0,0 +1,79 @@
+"""
+Local Pipeline Runner
+Streamer and consumer in one process over the in-memory transport
+"""
+import os
+import logging
+import threading
+from typing import List
+
+# Both sides must build their transports against the same in-process broker
+os.environ["MATCHMAKING_TRANSPORT"] = "memory"
+
+from src.matchmaking.consumer import MatchmakingConsumer
+from src.models.user_model import UserModel
+from src.models.wire_format import ENCODING_THIN
+from src.scripts.data_gen import generate_player
+from src.simulator.data_streamer import DataStreamer
+from src.simulator.load_generator import PROFILES, RateProfile
+from src.telemetry.logging_setup import configure_logging
+
+logger = logging.getLogger(__name__)
+
+SOURCES = ("auto", "db", "generated")
+
+
+def database_configured() -> bool:
+    """Whether connect_db() has a database to connect to, by private IP or Cloud SQL instance"""
+    return any(os.getenv(name) for name in ("DB_HOST", "DB_CONNECTION_NAME", "INSTANCE_CONNECTION_NAME"))
+
+
+def generate_users(count: int) -> List[UserModel]:
+    """Synthetic players that exist only in memory, for runs without a database"""
+    return [UserModel(**generate_player()) for _ in range(count)]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the full matchmaking pipeline without Pub/Sub")
+    parser.add_argument("--rate", type=float, default=1000.0, help="Target arrival rate in users/s")
+    parser.add_argument("--profile", choices=PROFILES, default="constant")
+    parser.add_argument("--duration", type=float, default=60.0, help="Seconds of load to generate")
+    parser.add_argument("--streams-per-region", type=int, default=4)
+    parser.add_argument("--batch", action="store_true", help="Consumer micro-batching mode")
+    parser.add_argument("--source", choices=SOURCES, default="auto",
+                        help="Players from the users table or generated in memory; auto uses the "
+                             "database when one is configured")
+    args = parser.parse_args()
+    configure_logging()
+
+    source = args.source
+    if source == "auto":
+        source = "db" if database_configured() else "generated"
+    if source == "db" and not database_configured():
+        parser.error("--source db needs DB_HOST or DB_CONNECTION_NAME, use --source generated to run without one")
+    if source == "generated" and os.getenv("PUBSUB_MESSAGE_ENCODING") == ENCODING_THIN:
+        parser.error("Thin messages are resolved against the users table, generated players need "
+                     "PUBSUB_MESSAGE_ENCODING=json or bin1")
+    logger.info(f"Sampling players from {'the database' if source == 'db' else 'the in-memory generator'}")
+
+    consumer = MatchmakingConsumer(batch_mode=args.batch or None)
+    consumer_thread = threading.Thread(target=consumer.start, name="consumer", daemon=True)
+    consumer_thread.start()
+
+    # Created after the consumer so Ctrl+C stops the load first
+    streamer = DataStreamer()
+    streamer.start_open_loop(
+        RateProfile(args.profile, rate=args.rate),
+        streams_per_region=args.streams_per_region,
+        duration=args.duration,
+        sample_users=generate_users if source == "generated" else None,
+    )
+
+    consumer.stop()
+    consumer_thread.join(timeout=10)
+    logger.info(
+        f"Local run: {streamer.users_sent} published, {consumer.messages_processed} consumed, "
+        f"{consumer.matchmaker.matches_formed} matches, {consumer.matchmaker.pool_size()} still waiting"
+    )
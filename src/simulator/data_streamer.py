@@ -2,49 +2,61 @@
 Data Streamer for Matchmaking Simulation using Google Pub/Sub
 """
 import logging
+import os
 import random
 import time
 import signal
 import sys
-from typing import Optional
-from sqlalchemy import func
+from typing import Callable, List, Optional
 from dotenv import load_dotenv
-from src.clients.database import connect_db, get_session
-from src.models.user_model import UserModel
+from src.clients.database import connect_db, get_session, pool_stats
+from src.simulator.load_generator import OpenLoopGenerator, RateProfile
 from src.simulator.publisher import MatchmakingPublisher
+from src.models.user_model import UserModel
+from src.simulator.user_sampler import UserSampler
+from src.telemetry.logging_setup import EventSummary, configure_logging
+from src.telemetry.metrics import start_metrics_server
+from src.telemetry.profiler import SamplingProfiler
 
 load_dotenv()
 logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 
 class DataStreamer:
-    def __init__(self, min_interval=10.0, max_interval=30.0, batch_size=100):
+    def __init__(self, min_interval=10.0, max_interval=30.0, batch_size=100, sampler_mode=None):
         self.min_interval = min_interval
         self.max_interval = max_interval
         self.batch_size = batch_size
         self.publisher: Optional[MatchmakingPublisher] = None
         self.is_running = False
         self.users_sent = 0
+        self.sampler = UserSampler(mode=sampler_mode)
+        self.generator: Optional[OpenLoopGenerator] = None
+        self.summary = EventSummary(logger, "streamer")
+        self.profiler = SamplingProfiler("streamer")
 
         signal.signal(signal.SIGINT, self._signal_handler)
         signal.signal(signal.SIGTERM, self._signal_handler)
+        self.profiler.install_signal_handler()
 
     def _signal_handler(self, signum, frame):
         logger.info(f"Received signal {signum}, shutting down...")
+        if self.generator:
+            # Let the event loop wind down, start_open_loop() stops the streamer afterwards
+            self.generator.stop()
+            return
         self.stop()
         sys.exit(0)
 
     def _get_random_users(self, session, count):
         try:
-            total_users = session.query(func.count(UserModel.user_id)).scalar()
-            if total_users == 0:
-                logger.warning("No users in DB")
-                return []
-            users = session.query(UserModel).order_by(func.random()).limit(count).all()
+            users = self.sampler.sample(session, count)
+            if not users:
+                logger.warning("No users available to sample")
             return users
         except Exception as e:
             logger.error(f"Error fetching users: {e}")
+            session.rollback()
             return []
 
     def start(self):
@@ -52,6 +64,8 @@ class DataStreamer:
         logger.info("DATA STREAMER STARTING")
         logger.info("=" * 60)
 
+        start_metrics_server()
+        self.profiler.start_if_requested()
         if not connect_db():
             logger.error("FAILED: Could not connect to database")
             return
@@ -69,18 +83,24 @@ class DataStreamer:
         session = get_session()
 
         try:
+            users = []
             while self.is_running:
-                users = self._get_random_users(session, self.batch_size)
+                # Publish every sampled user before sampling again instead of keeping one per query
                 if not users:
-                    time.sleep(5)
-                    continue
+                    users = self._get_random_users(session, self.batch_size)
+                    if not users:
+                        time.sleep(5)
+                        continue
 
-                user = random.choice(users)
+                user = users.pop()
                 if self.publisher.publish_user(user):
                     self.users_sent += 1
-                    logger.info(f"Published user {user.user_id[:8]}... (MMR: {user.mmr}, Region: {user.region})")
-                    if self.users_sent % 10 == 0:
-                        logger.info(f">>> Total published: {self.users_sent} users <<<")
+                    self.summary.count("published", mmr=user.mmr)
+                    if self.summary.sample():
+                        logger.info(f"Published user {user.user_id[:8]}... (MMR: {user.mmr}, Region: {user.region}), "
+                                    f"DB pool: {pool_stats()}")
+                else:
+                    self.summary.count("publish_failures")
 
                 time.sleep(random.uniform(self.min_interval, self.max_interval))
 
@@ -90,10 +110,59 @@ class DataStreamer:
             session.close()
             self.stop()
 
+    def start_open_loop(self, profile: RateProfile, streams_per_region: int = 4,
+                        duration: Optional[float] = None, report_interval: float = 10.0,
+                        sample_users: Optional[Callable[[int], List[UserModel]]] = None):
+        """
+        Publish on Poisson arrival schedules at the profile's rate instead of the sleep loop
+
+        Users are sampled from the database unless `sample_users` supplies them,
+        in which case no database connection is made.
+        """
+        logger.info("=" * 60)
+        logger.info("DATA STREAMER STARTING (open loop)")
+        logger.info("=" * 60)
+
+        start_metrics_server()
+        self.profiler.start_if_requested()
+        if sample_users is None:
+            if not connect_db():
+                logger.error("FAILED: Could not connect to database")
+                return
+            logger.info("SUCCESS: Database connection established")
+
+        self.publisher = MatchmakingPublisher()
+        if not self.publisher.connect():
+            logger.error("FAILED: Could not connect to Pub/Sub")
+            return
+        logger.info("SUCCESS: Pub/Sub connection established")
+
+        self.is_running = True
+        session = get_session() if sample_users is None else None
+        self.generator = OpenLoopGenerator(
+            self.publisher,
+            sample_users or (lambda count: self._get_random_users(session, count)),
+            profile,
+            streams_per_region=streams_per_region,
+            duration=duration,
+            report_interval=report_interval,
+        )
+        try:
+            self.generator.run()
+        except Exception as e:
+            logger.error(f"Error in streamer: {e}")
+        finally:
+            self.users_sent = self.generator.stats.dispatched
+            if session:
+                session.close()
+            self.stop()
+
     def stop(self):
         if not self.is_running:
             return
         self.is_running = False
+        self.summary.flush()
+        self.profiler.stop()
         logger.info(f"Stopping (published {self.users_sent} users)")
         if self.publisher:
             self.publisher.close()
@@ -105,11 +174,41 @@ if __name__ == "__main__":
     parser.add_argument("--min-interval", type=float, default=0.1)
     parser.add_argument("--max-interval", type=float, default=2.0)
     parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--sampler", choices=["keyset", "index", "tablesample"], default=None,
+                        help="User sampling strategy (default: STREAMER_SAMPLER_MODE or keyset)")
+    parser.add_argument("--transport", choices=["pubsub", "memory"], default=None,
+                        help="Message transport (default: MATCHMAKING_TRANSPORT or pubsub)")
+    parser.add_argument("--open-loop", action="store_true",
+                        help="Poisson arrivals at --rate users/s instead of sleeping between publishes")
+    parser.add_argument("--rate", type=float, default=100.0, help="Target arrival rate in users/s (open loop)")
+    parser.add_argument("--profile", choices=["constant", "ramp", "diurnal"], default="constant")
+    parser.add_argument("--start-rate", type=float, default=0.0, help="Initial rate for the ramp profile")
+    parser.add_argument("--ramp-seconds", type=float, default=60.0)
+    parser.add_argument("--period", type=float, default=600.0, help="Cycle length in seconds for the diurnal profile")
+    parser.add_argument("--amplitude", type=float, default=0.5, help="Relative swing of the diurnal profile")
+    parser.add_argument("--streams-per-region", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=None, help="Stop after this many seconds (open loop)")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="Serve Prometheus metrics on this port (default: METRICS_PORT, unset disables)")
     args = parser.parse_args()
+    configure_logging()
+    if args.transport:
+        os.environ["MATCHMAKING_TRANSPORT"] = args.transport
+    if args.metrics_port is not None:
+        os.environ["METRICS_PORT"] = str(args.metrics_port)
 
     streamer = DataStreamer(
         min_interval=args.min_interval,
         max_interval=args.max_interval,
-        batch_size=args.batch_size
+        batch_size=args.batch_size,
+        sampler_mode=args.sampler
     )
-    streamer.start()
+    if args.open_loop:
+        streamer.start_open_loop(
+            RateProfile(args.profile, rate=args.rate, start_rate=args.start_rate,
+                        ramp_seconds=args.ramp_seconds, period=args.period, amplitude=args.amplitude),
+            streams_per_region=args.streams_per_region,
+            duration=args.duration
+        )
+    else:
+        streamer.start()
@@ -0,0 +1,292 @@
+"""
+Open-loop Load Generator for the Data Streamer
+Publishes users on Poisson arrival schedules that do not wait for the system under test
+"""
+import math
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent import futures
+from functools import partial
+from typing import Callable, Deque, Dict, Iterator, List, Optional, Tuple
+from src.models.user_model import Region, UserModel
+from src.simulator.publisher import MatchmakingPublisher
+
+logger = logging.getLogger(__name__)
+
+PROFILES = ("constant", "ramp", "diurnal")
+
+# Most overdue arrivals a stream hands to the publish thread at once
+MAX_PUBLISH_BATCH = 500
+
+# Share of arrivals per region, same mix as the generated player population
+REGION_WEIGHTS = {
+    Region.America.value: 0.35,
+    Region.Europe.value: 0.30,
+    Region.Asia.value: 0.20,
+    Region.Africa.value: 0.10,
+    Region.Oceania.value: 0.05,
+}
+
+
+class RateProfile:
+    """
+    Target arrival rate (users/second) as a function of elapsed time
+
+    constant - `rate` throughout.
+    ramp     - linear from `start_rate` to `rate` over `ramp_seconds`, then `rate`.
+    diurnal  - sinusoid averaging `rate` with one cycle every `period` seconds,
+               starting at the trough of `rate * (1 - amplitude)`.
+    """
+
+    def __init__(self, kind: str = "constant", rate: float = 100.0, start_rate: float = 0.0,
+                 ramp_seconds: float = 60.0, period: float = 600.0, amplitude: float = 0.5):
+        if kind not in PROFILES:
+            raise ValueError(f"Unknown rate profile '{kind}', expected one of {PROFILES}")
+        self.kind = kind
+        self.rate = rate
+        self.start_rate = start_rate
+        self.ramp_seconds = ramp_seconds
+        self.period = period
+        self.amplitude = min(1.0, max(0.0, amplitude))
+
+    def rate_at(self, elapsed: float) -> float:
+        if self.kind == "ramp":
+            progress = min(1.0, elapsed / self.ramp_seconds) if self.ramp_seconds > 0 else 1.0
+            return self.start_rate + (self.rate - self.start_rate) * progress
+        if self.kind == "diurnal":
+            return self.rate * (1.0 - self.amplitude * math.cos(2 * math.pi * elapsed / self.period))
+        return self.rate
+
+    @property
+    def peak(self) -> float:
+        if self.kind == "ramp":
+            return max(self.rate, self.start_rate)
+        if self.kind == "diurnal":
+            return self.rate * (1.0 + self.amplitude)
+        return self.rate
+
+
+class LoadStats:
+    """Counters and publish lag samples shared with the publisher's callback threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.arrivals = 0
+        self.dispatched = 0
+        self.acked = 0
+        self.failed = 0
+        self.starved = 0
+        self._lags: List[float] = []
+
+    def record_done(self, arrival: float, error: Optional[Exception]):
+        lag = time.monotonic() - arrival
+        with self._lock:
+            if error is None:
+                self.acked += 1
+                self._lags.append(lag)
+            else:
+                self.failed += 1
+
+    def take_lags(self) -> List[float]:
+        with self._lock:
+            lags, self._lags = self._lags, []
+        return lags
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class OpenLoopGenerator:
+    """
+    Drives a publisher with many concurrent Poisson arrival streams
+
+    Every region gets `streams_per_region` asyncio tasks sharing the region's
+    part of the target rate. Each stream draws exponential inter-arrival gaps
+    and thins them against the profile's current rate, which keeps arrivals
+    Poisson while the rate ramps or cycles. Arrivals are scheduled against
+    the clock rather than after the previous publish, so a slow backend shows
+    up as growing publish lag instead of a lower offered load.
+
+    Users are pre-sampled in the background by `sample_users` (called in a
+    worker thread) into per-region buffers. An arrival that finds its
+    region's buffer empty is counted as starved and skipped.
+
+    Publish lag is measured from the scheduled arrival time to the Pub/Sub
+    acknowledgement of that message. Publishes are handed to a worker thread,
+    so a publisher blocked on its flow control limits stalls the streams
+    without freezing the event loop (and with it stop(), the duration timer
+    and the reporter).
+    """
+
+    def __init__(self, publisher: MatchmakingPublisher, sample_users: Callable[[int], List[UserModel]],
+                 profile: RateProfile, streams_per_region: int = 4, duration: Optional[float] = None,
+                 refill_size: Optional[int] = None, report_interval: float = 10.0,
+                 seed: Optional[int] = None):
+        self.publisher = publisher
+        self.sample_users = sample_users
+        self.profile = profile
+        self.streams_per_region = max(1, streams_per_region)
+        self.duration = duration
+        # Roughly one second of peak load per sampling round trip
+        self.refill_size = refill_size or max(100, int(profile.peak))
+        self.report_interval = report_interval
+        self.random = random.Random(seed)
+
+        self.stats = LoadStats()
+        # Bounded so a region that is oversampled does not pile up stale users
+        self.buffers: Dict[str, Deque[UserModel]] = {
+            region: deque(maxlen=max(100, int(4 * self.refill_size * weight)))
+            for region, weight in REGION_WEIGHTS.items()
+        }
+        self._started_at = 0.0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stopping: Optional[asyncio.Event] = None
+        # One thread keeps publishes in arrival order
+        self._publish_executor: Optional[futures.ThreadPoolExecutor] = None
+
+    def run(self):
+        self._publish_executor = futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="load-publish")
+        try:
+            asyncio.run(self._main())
+        finally:
+            self._publish_executor.shutdown(wait=True)
+
+    def stop(self):
+        """Safe to call from signal handlers and other threads"""
+        if self._loop and self._stopping:
+            self._loop.call_soon_threadsafe(self._stopping.set)
+
+    async def _main(self):
+        self._loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        self._started_at = time.monotonic()
+        logger.info(
+            f"Open-loop load: {self.profile.kind} profile, target {self.profile.rate:.0f}/s "
+            f"(peak {self.profile.peak:.0f}/s), {self.streams_per_region} streams per region"
+        )
+
+        await self._refill()
+        tasks = [asyncio.create_task(self._refiller()), asyncio.create_task(self._reporter())]
+        for region, weight in REGION_WEIGHTS.items():
+            share = weight / self.streams_per_region
+            for _ in range(self.streams_per_region):
+                seed = self.random.getrandbits(64)
+                tasks.append(asyncio.create_task(self._stream(region, share, random.Random(seed))))
+
+        try:
+            if self.duration:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.duration)
+            else:
+                await self._stopping.wait()
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self._log_summary()
+
+    async def _stream(self, region: str, share: float, rng: random.Random):
+        peak = self.profile.peak * share
+        if peak <= 0:
+            return
+        buffer = self.buffers[region]
+        arrivals = self._arrivals(peak, share, rng)
+        scheduled = next(arrivals)
+        while True:
+            delay = scheduled - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            # Every arrival already due goes to the publish thread in one hand-off
+            now = time.monotonic()
+            due = []
+            while scheduled <= now and len(due) < MAX_PUBLISH_BATCH:
+                self.stats.arrivals += 1
+                if buffer:
+                    due.append((buffer.popleft(), scheduled))
+                else:
+                    self.stats.starved += 1
+                scheduled = next(arrivals)
+            if due:
+                await self._loop.run_in_executor(self._publish_executor, self._publish, due)
+
+    def _arrivals(self, peak: float, share: float, rng: random.Random) -> Iterator[float]:
+        """Scheduled times of one stream's arrivals, on the monotonic clock"""
+        scheduled = time.monotonic()
+        while True:
+            # Thinning: candidates at the peak rate, kept with probability rate(t) / peak
+            scheduled += rng.expovariate(peak)
+            if rng.random() * peak <= self.profile.rate_at(scheduled - self._started_at) * share:
+                yield scheduled
+
+    def _publish(self, due: List[Tuple[UserModel, float]]):
+        """Runs on the publish thread, the only writer of `stats.dispatched`"""
+        for user, scheduled in due:
+            if self.publisher.publish_user_async(user, on_done=partial(self.stats.record_done, scheduled)):
+                self.stats.dispatched += 1
+
+    async def _refiller(self):
+        while True:
+            if any(len(self.buffers[region]) < self.refill_size * weight for region, weight in REGION_WEIGHTS.items()):
+                await self._refill()
+            else:
+                await asyncio.sleep(0.05)
+
+    async def _refill(self):
+        try:
+            users = await asyncio.to_thread(self.sample_users, self.refill_size)
+        except Exception as e:
+            logger.error(f"Error sampling users for load generation: {e}")
+            await asyncio.sleep(1)
+            return
+        if not users:
+            logger.warning("No users available to sample")
+            await asyncio.sleep(1)
+            return
+        for user in users:
+            buffer = self.buffers.get(user.region)
+            if buffer is not None:
+                buffer.append(user)
+
+    async def _reporter(self):
+        window_start = time.monotonic()
+        dispatched = 0
+        while True:
+            await asyncio.sleep(self.report_interval)
+            now = time.monotonic()
+            lags = self.stats.take_lags()
+            logger.info(
+                f"Load: target {self._mean_target(window_start, now):.0f}/s, "
+                f"achieved {(self.stats.dispatched - dispatched) / (now - window_start):.0f}/s, "
+                f"publish lag p50 {percentile(lags, 0.5) * 1000:.1f}ms p99 {percentile(lags, 0.99) * 1000:.1f}ms, "
+                f"starved {self.stats.starved}, outstanding {self.publisher.pending}"
+            )
+            window_start, dispatched = now, self.stats.dispatched
+
+    def _mean_target(self, start: float, end: float, samples: int = 50) -> float:
+        """Average of the profile's rate over [start, end] (monotonic times)"""
+        step = (end - start) / samples
+        return sum(
+            self.profile.rate_at(start - self._started_at + (i + 0.5) * step) for i in range(samples)
+        ) / samples
+
+    def _log_summary(self):
+        now = time.monotonic()
+        elapsed = now - self._started_at
+        if elapsed <= 0:
+            return
+        stats = self.stats
+        logger.info(
+            f"Load summary: {elapsed:.1f}s, target {self._mean_target(self._started_at, now):.0f}/s, "
+            f"achieved {stats.dispatched / elapsed:.0f}/s, arrivals {stats.arrivals}, "
+            f"published {stats.dispatched} (acked {stats.acked}, failed {stats.failed}), starved {stats.starved}"
+        )
@@ -1,50 +1,155 @@
 """
-Google Pub/Sub Publisher for Matchmaking System
+Publisher for Matchmaking System (Google Pub/Sub or in-memory transport)
 """
+import time
+import uuid
 import logging
-from typing import Optional
-from google.cloud import pubsub_v1
-from src.clients.pubsub_config import PubSubConfig
+import threading
+from concurrent import futures
+from functools import partial
+from typing import Callable, Iterable, Optional, Set
+from src.clients.pubsub_config import PARTITION_ATTRIBUTE, PubSubConfig
+from src.clients.transport import Transport, create_transport
 from src.models.user_model import UserModel
+from src.models.wire_format import ENCODING_ATTRIBUTE, TICKET_ID_ATTRIBUTE, encode_user
+from src.telemetry.metrics import REGISTRY, STAGE_SECONDS
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+PUBLISHED = REGISTRY.counter("matchmaking_published_total", "Tickets published", labels=("outcome",))
+# Until the transport confirmed the publish, including time spent in the client's batcher
+PUBLISH_SECONDS = STAGE_SECONDS.labels("publish")
+
 
 class MatchmakingPublisher:
-    def __init__(self, config: Optional[PubSubConfig] = None):
+    def __init__(self, config: Optional[PubSubConfig] = None,
+                 on_error: Optional[Callable[[str, Exception], None]] = None,
+                 transport: Optional[Transport] = None):
         self.config = config or PubSubConfig.from_env()
-        self.publisher: Optional[pubsub_v1.PublisherClient] = None
-        self.topic_path: Optional[str] = None
+        self.transport = transport
         self.is_connected = False
 
+        # Non-blocking publish bookkeeping, updated from the client's done-callbacks
+        self.on_error = on_error
+        self.published = 0
+        self.failed = 0
+        self._pending: Set[futures.Future] = set()
+        self._lock = threading.Lock()
+
     def connect(self) -> bool:
         try:
-            self.publisher = pubsub_v1.PublisherClient()
-            self.topic_path = self.publisher.topic_path(
-                self.config.project_id, self.config.topic_id
-            )
+            self.transport = self.transport or create_transport(config=self.config)
+            self.transport.connect_publisher()
             self.is_connected = True
-            logger.info(f"Pub/Sub publisher connected to topic: {self.config.topic_id}")
+            logger.info(f"Publisher connected to topic: {self.config.topic_id} ({self.transport.name})")
             return True
         except Exception as e:
             logger.error(f"Failed to connect publisher: {e}")
             return False
 
     def publish_user(self, user: UserModel) -> bool:
-        if not self.is_connected or not self.publisher:
+        if not self.is_connected:
             logger.error("Publisher not connected")
             return False
         try:
-            data = user.to_json().encode("utf-8")
-            future = self.publisher.publish(self.topic_path, data, user_id=str(user.user_id))
-            future.result()  # Wait for publish to complete
+            with PUBLISH_SECONDS.time():
+                future = self._publish(user)
+                future.result()  # Wait for publish to complete
+            PUBLISHED.labels("ok").inc()
             return True
         except Exception as e:
             logger.error(f"Failed to publish user {user.user_id}: {e}")
+            PUBLISHED.labels("failed").inc()
+            return False
+
+    def publish_user_async(self, user: UserModel,
+                           on_done: Optional[Callable[[Optional[Exception]], None]] = None) -> bool:
+        """
+        Hand a user to the client's batcher without waiting for the round trip
+
+        The outcome is recorded by a done-callback in `published`/`failed`,
+        failures are also passed to `on_error`. `on_done` is called from the
+        client's thread with the error, or None once the publish succeeded.
+        Blocks only when the configured flow-control limits on outstanding
+        messages are reached.
+        """
+        if not self.is_connected:
+            logger.error("Publisher not connected")
+            return False
+        user_id = str(user.user_id)
+        started = time.perf_counter()
+        try:
+            future = self._publish(user)
+        except Exception as e:
+            self._record_failure(user_id, e)
+            if on_done:
+                on_done(e)
             return False
 
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(partial(self._on_publish_done, user_id, on_done, started))
+        return True
+
+    def publish_many(self, users: Iterable[UserModel]) -> int:
+        """Publish several users without blocking, returns how many were accepted"""
+        return sum(1 for user in users if self.publish_user_async(user))
+
+    def _publish(self, user: UserModel) -> futures.Future:
+        data, encoding = encode_user(user, self.config.message_encoding)
+        attributes = {"user_id": str(user.user_id), ENCODING_ATTRIBUTE: encoding, TICKET_ID_ATTRIBUTE: uuid.uuid4().hex}
+        partition = self.config.partition_key(user.region, user.mmr)
+        if partition:
+            attributes[PARTITION_ATTRIBUTE] = partition
+        return self.transport.publish(data, ordering_key=partition, **attributes)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait for all outstanding publishes, returns False if some are still pending"""
+        with self._lock:
+            pending = list(self._pending)
+        if not pending:
+            return True
+        _, not_done = futures.wait(pending, timeout=timeout)
+        return not not_done
+
+    @property
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def _on_publish_done(self, user_id: str, on_done: Optional[Callable[[Optional[Exception]], None]],
+                         started: float, future: futures.Future):
+        with self._lock:
+            self._pending.discard(future)
+        error = future.exception()
+        if error is None:
+            PUBLISH_SECONDS.observe(time.perf_counter() - started)
+            PUBLISHED.labels("ok").inc()
+            with self._lock:
+                self.published += 1
+        else:
+            self._record_failure(user_id, error)
+        if on_done:
+            try:
+                on_done(error)
+            except Exception as e:
+                logger.error(f"Publish done callback failed: {e}")
+
+    def _record_failure(self, user_id: str, error: Exception):
+        PUBLISHED.labels("failed").inc()
+        with self._lock:
+            self.failed += 1
+        logger.error(f"Failed to publish user {user_id}: {error}")
+        if self.on_error:
+            try:
+                self.on_error(user_id, error)
+            except Exception as e:
+                logger.error(f"Publish error callback failed: {e}")
+
     def close(self):
-        if self.publisher:
-            logger.info("Closing Pub/Sub publisher")
+        if self.transport and self.is_connected:
+            logger.info("Closing publisher")
+            if not self.flush(timeout=30):
+                logger.warning(f"Closing with {self.pending} publishes still outstanding")
+            self.transport.close()
             self.is_connected = False
@@ -0,0 +1,115 @@
+"""
+User Sampler for the Data Streamer
+Picks random users without scanning and sorting the whole users table
+"""
+import os
+import time
+import uuid
+import random
+import logging
+from typing import List, Optional
+from sqlalchemy import text
+from src.models.user_model import UserModel
+
+logger = logging.getLogger(__name__)
+
+SAMPLER_MODES = ("keyset", "index", "tablesample")
+
+# One round trip: every random probe jumps to the next user_id through the primary key index
+KEYSET_QUERY = """
+    SELECT u.* FROM unnest(CAST(:probes AS varchar[])) AS p(probe)
+    CROSS JOIN LATERAL (
+        SELECT * FROM users
+        WHERE user_id >= p.probe {ingame_filter}
+        ORDER BY user_id
+        LIMIT 1
+    ) AS u
+"""
+
+
+class UserSampler:
+    """
+    Random user sampling whose cost does not grow with the users table
+
+    Modes:
+      keyset      - random UUID probes resolved with primary key lookups (default).
+                    User ids are UUID4 strings, so probes land uniformly.
+      index       - in-memory list of user ids, refreshed every `refresh_interval`
+                    seconds; sampled rows are fetched by primary key.
+      tablesample - TABLESAMPLE SYSTEM over a percentage derived from the
+                    planner's row estimate, refreshed every `refresh_interval`.
+    """
+
+    def __init__(self, mode: Optional[str] = None, exclude_ingame: Optional[bool] = None,
+                 refresh_interval: Optional[float] = None):
+        self.mode = mode or os.getenv("STREAMER_SAMPLER_MODE", "keyset")
+        if self.mode not in SAMPLER_MODES:
+            raise ValueError(f"Unknown sampler mode '{self.mode}', expected one of {SAMPLER_MODES}")
+        if exclude_ingame is None:
+            exclude_ingame = os.getenv("STREAMER_EXCLUDE_INGAME", "true").lower() == "true"
+        self.exclude_ingame = exclude_ingame
+        self.refresh_interval = refresh_interval or float(os.getenv("STREAMER_SAMPLER_REFRESH", "60"))
+
+        self._user_ids: List[str] = []
+        self._estimated_rows = 0
+        self._refreshed_at = 0.0
+
+    def sample(self, session, count: int) -> List[UserModel]:
+        if self.mode == "keyset":
+            return self._sample_keyset(session, count)
+        if self._is_stale():
+            self._refresh(session)
+        if self.mode == "index":
+            return self._sample_index(session, count)
+        return self._sample_tablesample(session, count)
+
+    def _is_stale(self) -> bool:
+        return time.monotonic() - self._refreshed_at >= self.refresh_interval
+
+    def _refresh(self, session):
+        if self.mode == "index":
+            query = session.query(UserModel.user_id)
+            if self.exclude_ingame:
+                query = query.filter(UserModel.ingame.is_(False))
+            self._user_ids = [user_id for (user_id,) in query]
+            logger.info(f"Sampler index refreshed with {len(self._user_ids)} users")
+        else:
+            estimate = session.execute(
+                text("SELECT reltuples FROM pg_class WHERE relname = 'users'")
+            ).scalar()
+            self._estimated_rows = max(0, int(estimate or 0))
+        self._refreshed_at = time.monotonic()
+
+    def _sample_keyset(self, session, count: int) -> List[UserModel]:
+        ingame_filter = "AND ingame = false" if self.exclude_ingame else ""
+        probes = [str(uuid.uuid4()) for _ in range(count)]
+        return (
+            session.query(UserModel)
+            .from_statement(text(KEYSET_QUERY.format(ingame_filter=ingame_filter)))
+            .params(probes=probes)
+            .all()
+        )
+
+    def _sample_index(self, session, count: int) -> List[UserModel]:
+        if not self._user_ids:
+            return []
+        user_ids = random.sample(self._user_ids, min(count, len(self._user_ids)))
+        query = session.query(UserModel).filter(UserModel.user_id.in_(user_ids))
+        if self.exclude_ingame:
+            query = query.filter(UserModel.ingame.is_(False))
+        return query.all()
+
+    def _sample_tablesample(self, session, count: int) -> List[UserModel]:
+        if self._estimated_rows <= 0:
+            # Never analyzed, fall back to the primary key probes
+            return self._sample_keyset(session, count)
+        # Oversample so the page-level sample still yields `count` rows after filtering
+        percent = min(100.0, 300.0 * count / self._estimated_rows)
+        ingame_filter = "WHERE ingame = false" if self.exclude_ingame else ""
+        statement = text(f"SELECT * FROM users TABLESAMPLE SYSTEM (CAST(:percent AS real)) {ingame_filter} LIMIT :count")
+        return (
+            session.query(UserModel)
+            .from_statement(statement)
+            .params(percent=percent, count=count)
+            .all()
+        )
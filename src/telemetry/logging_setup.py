@@ -0,0 +1,218 @@
+"""
+Logging Setup
+Queue-based asynchronous logging with per-call-site rate limits
+"""
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional, Tuple
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+_listener: Optional[QueueListener] = None
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    Hands records to the listener thread without ever blocking the caller
+
+    Formatting and I/O happen on the listener thread. When the queue is
+    full the record is dropped and counted, the count is reported with
+    the next record that gets through.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            if self.dropped:
+                dropped, self.dropped = self.dropped, 0
+                record.msg = f"{record.msg} [{dropped} log records dropped, queue full]"
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Keep the record as is, the listener formats it; only make it safe to hand over
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Token bucket per call site (logger, file, line)
+
+    Each call site may log `rate` records per second with bursts of
+    `burst`. Excess records are dropped before they are queued, and the
+    number suppressed is appended to the next record from that site.
+    Records at or above `exempt_level` always pass.
+    """
+
+    def __init__(self, rate: float = 20.0, burst: int = 50, exempt_level: int = logging.CRITICAL):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.exempt_level = exempt_level
+        # call site -> (tokens, last refill, suppressed since last pass)
+        self._buckets: Dict[Tuple[str, str, int], Tuple[float, float, int]] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= self.exempt_level or self.rate <= 0:
+            return True
+        site = (record.name, record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            tokens, refilled_at, suppressed = self._buckets.get(site, (float(self.burst), now, 0))
+            tokens = min(float(self.burst), tokens + (now - refilled_at) * self.rate)
+            if tokens < 1.0:
+                self._buckets[site] = (tokens, now, suppressed + 1)
+                return False
+            self._buckets[site] = (tokens - 1.0, now, 0)
+        if suppressed:
+            record.msg = f"{record.msg} [{suppressed} similar suppressed]"
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, fields from `extra={"fields": {...}}` are merged in"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "severity": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class EventSummary:
+    """
+    Aggregates hot-path events and logs them as one line per interval
+
+    count() is a dict update under a lock, no record is created per event.
+    The first count() after `interval` seconds logs a structured summary
+    (counts, plus sum/max of any numeric values passed) and starts a new
+    interval. sample() lets callers keep a detailed log for a random
+    `sample_rate` fraction of events.
+    """
+
+    def __init__(self, logger: logging.Logger, name: str, interval: Optional[float] = None,
+                 sample_rate: Optional[float] = None):
+        self.logger = logger
+        self.name = name
+        self.interval = interval or float(os.getenv("LOG_SUMMARY_INTERVAL", "10"))
+        self.sample_rate = sample_rate if sample_rate is not None else float(os.getenv("LOG_SAMPLE_RATE", "0.01"))
+        self._counts: Dict[str, int] = {}
+        self._sums: Dict[str, float] = {}
+        self._maxes: Dict[str, float] = {}
+        self._events: Dict[str, str] = {}
+        self._started_at = time.monotonic()
+        self._lock = threading.Lock()
+        self._random = random.Random()
+
+    def count(self, event: str, n: int = 1, **values: float):
+        with self._lock:
+            self._counts[event] = self._counts.get(event, 0) + n
+            for key, value in values.items():
+                field = f"{event}_{key}"
+                self._events[field] = event
+                self._sums[field] = self._sums.get(field, 0.0) + value
+                if value > self._maxes.get(field, float("-inf")):
+                    self._maxes[field] = value
+            if time.monotonic() - self._started_at < self.interval:
+                return
+            fields = self._take()
+        self._log(fields)
+
+    def sample(self) -> bool:
+        return self._random.random() < self.sample_rate
+
+    def flush(self):
+        with self._lock:
+            fields = self._take()
+        if fields["counts"]:
+            self._log(fields)
+
+    def _take(self) -> dict:
+        now = time.monotonic()
+        elapsed = max(now - self._started_at, 1e-9)
+        fields = {
+            "summary": self.name,
+            "interval_s": round(elapsed, 3),
+            "counts": self._counts,
+            "rates": {event: round(n / elapsed, 1) for event, n in self._counts.items()},
+            "means": {field: round(total / self._counts[self._events[field]], 3) for field, total in self._sums.items()},
+            "max": {field: round(value, 3) for field, value in self._maxes.items()},
+        }
+        self._counts, self._sums, self._maxes, self._events = {}, {}, {}, {}
+        self._started_at = now
+        return fields
+
+    def _log(self, fields: dict):
+        counts = ", ".join(f"{event}={n} ({fields['rates'][event]}/s)" for event, n in fields["counts"].items())
+        means = ", ".join(f"{field}={value}" for field, value in fields["means"].items())
+        self.logger.info(f"{self.name} {fields['interval_s']:.0f}s: {counts}{'; mean ' + means if means else ''}",
+                         extra={"fields": fields})
+
+
+def configure_logging(level: Optional[str] = None):
+    """
+    Route all logging through a bounded queue to a background writer thread
+
+    Replaces per-module basicConfig calls; safe to call more than once.
+    Settings come from the environment:
+      LOG_LEVEL       - root level (default INFO)
+      LOG_JSON        - "true" for JSON lines (structured logs on Cloud Run)
+      LOG_QUEUE_SIZE  - records buffered before new ones are dropped (default 10000)
+      LOG_RATE_LIMIT  - records per second per call site, 0 disables (default 20)
+      LOG_RATE_BURST  - burst per call site (default 50)
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    stream = logging.StreamHandler(sys.stderr)
+    if os.getenv("LOG_JSON", "false").lower() == "true":
+        stream.setFormatter(JsonFormatter())
+    else:
+        stream.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    handler = DroppingQueueHandler(queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", "10000"))))
+    handler.addFilter(RateLimitFilter(
+        rate=float(os.getenv("LOG_RATE_LIMIT", "20")),
+        burst=int(os.getenv("LOG_RATE_BURST", "50")),
+    ))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel((level or os.getenv("LOG_LEVEL", "INFO")).upper())
+
+    _listener = QueueListener(handler.queue, stream, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Flush queued records and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
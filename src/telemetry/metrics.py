@@ -0,0 +1,294 @@
+"""
+Metrics
+In-process counters, gauges and histograms served in Prometheus text format
+"""
+import os
+import time
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Seconds, from 50us (a decode) to 10s (a stalled database flush)
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _PerThreadCells:
+    """
+    One mutable cell per writing thread, summed when read
+
+    Each thread only ever updates its own cell, so recording takes no lock;
+    the lock is taken once per thread, when its cell is created. Cells of
+    finished threads are kept, their counts still belong to the total.
+    """
+
+    def __init__(self, width: int):
+        self._width = width
+        self._local = threading.local()
+        self._cells: List[list] = []
+        self._lock = threading.Lock()
+
+    def cell(self) -> list:
+        try:
+            return self._local.cell
+        except AttributeError:
+            cell = self._local.cell = [0] * self._width
+            with self._lock:
+                self._cells.append(cell)
+            return cell
+
+    def totals(self) -> list:
+        with self._lock:
+            cells = list(self._cells)
+        return [sum(column) for column in zip(*cells)] if cells else [0] * self._width
+
+
+class Counter:
+    def __init__(self):
+        self._cells = _PerThreadCells(1)
+
+    def inc(self, amount: float = 1):
+        self._cells.cell()[0] += amount
+
+    def value(self) -> float:
+        return self._cells.totals()[0]
+
+
+class Gauge:
+    """Last value set, or the result of `function` at scrape time when one is given"""
+
+    def __init__(self):
+        self._value = 0.0
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float):
+        self._value = value
+
+    def set_function(self, function: Callable[[], float]):
+        self._function = function
+
+    def value(self) -> float:
+        if self._function is not None:
+            try:
+                return self._function()
+            except Exception as e:
+                logger.debug(f"Gauge function failed: {e}")
+                return float("nan")
+        return self._value
+
+
+class Histogram:
+    """Fixed buckets; each thread counts into its own row of [bucket counts..., +Inf, sum]"""
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._cells = _PerThreadCells(len(self.buckets) + 2)
+
+    def observe(self, value: float):
+        cell = self._cells.cell()
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    def time(self) -> "_Timer":
+        """Context manager observing the duration of its block"""
+        return _Timer(self)
+
+    def value(self) -> Tuple[List[int], int, float]:
+        """Cumulative bucket counts, total count and sum"""
+        totals = self._cells.totals()
+        cumulative, running = [], 0
+        for count in totals[:-1]:
+            running += count
+            cumulative.append(running)
+        return cumulative, running, totals[-1]
+
+
+class _Timer:
+    __slots__ = ("histogram", "started")
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started)
+        return False
+
+
+class MetricFamily:
+    """
+    A named metric with one child per combination of label values
+
+    Unlabelled families proxy inc/set/observe/time to their single child.
+    """
+
+    def __init__(self, kind: str, name: str, help: str, labels: Sequence[str], factory: Callable[[], object]):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._factory = factory
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values: str):
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.label_names):
+                raise ValueError(f"{self.name} takes labels {self.label_names}, got {key}")
+            with self._lock:
+                child = self._children.setdefault(key, self._factory())
+        return child
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def set_function(self, function: Callable[[], float]):
+        self.labels().set_function(function)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def time(self) -> _Timer:
+        return self.labels().time()
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            children = sorted(self._children.items())
+        for key, child in children:
+            labels = [f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, key)]
+            if self.kind == "histogram":
+                cumulative, count, total = child.value()
+                bounds = [_format(bound) for bound in child.buckets] + ["+Inf"]
+                for bound, running in zip(bounds, cumulative):
+                    le = f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{_labels(labels + [le])} {running}")
+                lines.append(f"{self.name}_sum{_labels(labels)} {_format(total)}")
+                lines.append(f"{self.name}_count{_labels(labels)} {count}")
+            else:
+                lines.append(f"{self.name}{_labels(labels)} {_format(child.value())}")
+        return lines
+
+
+class MetricsRegistry:
+    """Registered metric families by name; asking for an existing name returns the same family"""
+
+    def __init__(self):
+        self._families: Dict[str, MetricFamily] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> MetricFamily:
+        return self._register("counter", name, help, labels, Counter)
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = ()) -> MetricFamily:
+        return self._register("gauge", name, help, labels, Gauge)
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> MetricFamily:
+        return self._register("histogram", name, help, labels, lambda: Histogram(buckets))
+
+    def _register(self, kind: str, name: str, help: str, labels: Sequence[str], factory) -> MetricFamily:
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = self._families[name] = MetricFamily(kind, name, help, labels, factory)
+            elif family.kind != kind or family.label_names != tuple(labels):
+                raise ValueError(f"Metric {name} is already registered as a {family.kind} {family.label_names}")
+            return family
+
+    def render(self) -> str:
+        with self._lock:
+            families = sorted(self._families.values(), key=lambda family: family.name)
+        return "\n".join(line for family in families for line in family.render()) + "\n"
+
+
+def _labels(labels: List[str]) -> str:
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format(value: float) -> str:
+    if value != value:
+        return "NaN"
+    if value in (float("inf"), float("-inf")):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+# Process-wide registry, the consumer and the streamer share it when run in one process
+REGISTRY = MetricsRegistry()
+
+# Shared by the consumer, the match persister and the publisher
+STAGE_SECONDS = REGISTRY.histogram(
+    "matchmaking_stage_seconds",
+    "Time per call of a pipeline stage (decode, match, tick, balance, ack, persist, publish)",
+    labels=("stage",),
+)
+
+_server: Optional[ThreadingHTTPServer] = None
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry: MetricsRegistry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: Optional[int] = None, host: Optional[str] = None) -> Optional[ThreadingHTTPServer]:
+    """
+    Serve REGISTRY at http://host:port/metrics from a daemon thread
+
+    Port and host default to METRICS_PORT (unset or 0 disables the endpoint)
+    and METRICS_HOST (127.0.0.1). Only one server is started per process.
+    """
+    global _server
+    if _server is not None:
+        return _server
+    port = port if port is not None else int(os.getenv("METRICS_PORT", "0") or 0)
+    if not port:
+        return None
+    host = host or os.getenv("METRICS_HOST", "127.0.0.1")
+    try:
+        _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        logger.error(f"Could not start metrics endpoint on {host}:{port}: {e}")
+        return None
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return _server
+
+
+def stop_metrics_server():
+    global _server
+    if _server is not None:
+        _server.shutdown()
+        _server.server_close()
+        _server = None
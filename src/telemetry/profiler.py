@@ -0,0 +1,190 @@
+"""
+Sampling Profiler
+Periodic stack samples of every thread, started and stopped at runtime
+"""
+import os
+import re
+import sys
+import time
+import signal
+import logging
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# filename, first line, function name
+FrameKey = Tuple[str, int, str]
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of all threads every `interval` seconds from a background thread
+
+    Nothing is hooked into the profiled code: the Pub/Sub callback threads,
+    the matcher loop and the event loop keep running while a sampler thread
+    reads sys._current_frames(). A session runs until stop() or for
+    `duration` seconds, then writes two files to `output_dir`:
+      <name>-<pid>-<time>.folded  collapsed stacks, one "thread;outer;...;inner count"
+                                  line per stack (flamegraph.pl, speedscope)
+      <name>-<pid>-<time>.txt     top functions by own and cumulative samples per thread
+
+    Pool threads are grouped by name without their index (ThreadPoolExecutor-0).
+    """
+
+    def __init__(self, name: str, interval: Optional[float] = None, duration: Optional[float] = None,
+                 output_dir: Optional[str] = None, max_depth: int = 64):
+        self.name = name
+        self.interval = interval or float(os.getenv("PROFILE_INTERVAL", "0.01"))
+        self.duration = duration or float(os.getenv("PROFILE_DURATION", "30"))
+        self.output_dir = output_dir or os.getenv("PROFILE_DIR", ".")
+        self.max_depth = max_depth
+
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._toggle_requested = threading.Event()
+        self._watcher: Optional[threading.Thread] = None
+        self.last_dump: Optional[str] = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, duration: Optional[float] = None) -> bool:
+        """Begin a session of `duration` seconds (default: PROFILE_DURATION), False if one is running"""
+        with self._lock:
+            if self.is_running:
+                return False
+            self._stopping.clear()
+            self._thread = threading.Thread(
+                target=self._run, args=(duration or self.duration,), name="profiler", daemon=True
+            )
+            self._thread.start()
+        logger.info(f"Profiling {self.name} every {self.interval * 1000:.0f}ms for up to {duration or self.duration:.0f}s")
+        return True
+
+    def stop(self, timeout: float = 5.0):
+        """End the running session early; its samples are still written"""
+        thread = self._thread
+        if thread is None:
+            return
+        self._stopping.set()
+        if thread is not threading.current_thread():
+            thread.join(timeout=timeout)
+
+    def toggle(self):
+        if self.is_running:
+            # Only signals the sampler, it writes the files from its own thread
+            self._stopping.set()
+        else:
+            self.start()
+
+    def start_if_requested(self):
+        """Start a session right away when PROFILE_ON_START is true"""
+        if os.getenv("PROFILE_ON_START", "false").lower() == "true":
+            self.start()
+
+    def install_signal_handler(self, signum: Optional[int] = None):
+        """
+        Toggle profiling with SIGUSR1 (kill -USR1 <pid>); not available on Windows
+
+        The handler runs on the main thread between bytecodes, possibly while
+        that thread holds `_lock` or a logging lock, so it only sets an event
+        and a watcher thread does the toggling.
+        """
+        signum = signum or getattr(signal, "SIGUSR1", None)
+        if signum is None:
+            return
+        try:
+            signal.signal(signum, lambda received, frame: self._toggle_requested.set())
+        except ValueError:
+            logger.debug("Not in the main thread, profiling can only be started with PROFILE_ON_START")
+            return
+        if self._watcher is None:
+            self._watcher = threading.Thread(target=self._watch_signal, name="profiler-signal", daemon=True)
+            self._watcher.start()
+
+    def _watch_signal(self):
+        while True:
+            self._toggle_requested.wait()
+            self._toggle_requested.clear()
+            try:
+                self.toggle()
+            except Exception as e:
+                logger.error(f"Failed to toggle profiling: {e}")
+
+    def _run(self, duration: float):
+        stacks: Counter = Counter()
+        samples = 0
+        own_ident = threading.get_ident()
+        started = time.monotonic()
+        deadline = started + duration
+        while not self._stopping.is_set() and time.monotonic() < deadline:
+            names = {thread.ident: _group_name(thread.name) for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stacks[(names.get(ident, str(ident)), self._stack(frame))] += 1
+            samples += 1
+            self._stopping.wait(self.interval)
+        elapsed = time.monotonic() - started
+
+        try:
+            self.last_dump = self._write(stacks, samples, elapsed)
+            logger.info(f"Profile of {samples} samples over {elapsed:.1f}s written to {self.last_dump}.*")
+        except Exception as e:
+            logger.error(f"Failed to write profile: {e}")
+
+    def _stack(self, frame) -> Tuple[FrameKey, ...]:
+        """Outermost call first"""
+        keys: List[FrameKey] = []
+        while frame is not None and len(keys) < self.max_depth:
+            code = frame.f_code
+            keys.append((code.co_filename, code.co_firstlineno, code.co_name))
+            frame = frame.f_back
+        keys.reverse()
+        return tuple(keys)
+
+    def _write(self, stacks: Counter, samples: int, elapsed: float) -> str:
+        os.makedirs(self.output_dir, exist_ok=True)
+        base = os.path.join(self.output_dir, f"{self.name}-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}")
+
+        with open(f"{base}.folded", "w") as f:
+            for (thread, stack), count in stacks.most_common():
+                f.write(";".join([thread] + [_label(key) for key in stack]) + f" {count}\n")
+
+        by_thread: Dict[str, Tuple[Counter, Counter, int]] = {}
+        for (thread, stack), count in stacks.items():
+            own, cumulative, total = by_thread.get(thread, (Counter(), Counter(), 0))
+            if stack:
+                own[stack[-1]] += count
+                for key in set(stack):
+                    cumulative[key] += count
+            by_thread[thread] = (own, cumulative, total + count)
+
+        with open(f"{base}.txt", "w") as f:
+            f.write(f"{self.name}: {samples} samples every {self.interval * 1000:.0f}ms over {elapsed:.1f}s\n")
+            for thread, (own, cumulative, total) in sorted(by_thread.items(), key=lambda item: -item[1][2]):
+                f.write(f"\n== {thread} ({total} thread samples)\n")
+                f.write(f"{'own %':>7} {'cum %':>7}  function\n")
+                for key, count in own.most_common(25):
+                    f.write(f"{100 * count / total:7.1f} {100 * cumulative[key] / total:7.1f}  {_label(key)}\n")
+        return base
+
+
+def _group_name(name: str) -> str:
+    return re.sub(r"_\d+$", "", name)
+
+
+def _label(key: FrameKey) -> str:
+    filename, line, function = key
+    try:
+        relative = os.path.relpath(filename)
+        if not relative.startswith(".."):
+            filename = relative
+    except ValueError:
+        pass
+    return f"{function} ({filename}:{line})"
+
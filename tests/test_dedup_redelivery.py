@@ -0,0 +1,89 @@
+"""
+Redelivered tickets must not put a matched player into a second lobby
+"""
+import threading
+import time
+import uuid
+
+import pytest
+
+from src.clients.pubsub_config import PubSubConfig
+from src.clients.transport import create_transport
+from src.matchmaking.consumer import MatchmakingConsumer
+from src.models.wire_format import ENCODING_ATTRIBUTE, ENCODING_JSON, TICKET_ID_ATTRIBUTE, encode_user
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+@pytest.fixture
+def consumer(monkeypatch):
+    monkeypatch.setenv("MATCHMAKING_TRANSPORT", "memory")
+    monkeypatch.setenv("PUBSUB_TOPIC_ID", f"test-{uuid.uuid4().hex}")
+    monkeypatch.setenv("LOBBY_SIZE", "2")
+    monkeypatch.setenv("DEDUP_TTL", "60")
+    monkeypatch.setenv("TEAM_BALANCE", "false")
+    config = PubSubConfig.from_env()
+    consumer = MatchmakingConsumer(config=config, batch_mode=False)
+    consumer.matches = []
+    handle_matches = consumer._handle_matches
+
+    def record(matches):
+        consumer.matches.extend([player.user_id for player in match["players"]] for match in matches)
+        handle_matches(matches)
+
+    consumer._handle_matches = record
+    thread = threading.Thread(target=consumer.start, daemon=True)
+    thread.start()
+    assert _wait_for(lambda: consumer.is_running)
+    publisher = create_transport(config=config)
+    publisher.connect_publisher()
+    yield consumer, publisher
+    consumer.stop()
+    thread.join(timeout=5)
+
+
+def _send(publisher, user_id, mmr, ticket_id=None):
+    """Publish a ticket; sending an earlier ticket_id again stands in for a Pub/Sub redelivery"""
+    user = {"user_id": user_id, "mmr": mmr, "region": "America", "level": 1, "games_played": 1}
+    data, _ = encode_user(user, ENCODING_JSON)
+    ticket_id = ticket_id or uuid.uuid4().hex
+    publisher.publish(data, user_id=user_id, **{ENCODING_ATTRIBUTE: ENCODING_JSON, TICKET_ID_ATTRIBUTE: ticket_id})
+    return ticket_id
+
+
+def test_redelivery_after_match_is_dropped(consumer):
+    consumer, publisher = consumer
+    a, b, d = (str(uuid.uuid4()) for _ in range(3))
+
+    ticket_a = _send(publisher, a, 1000)
+    _send(publisher, b, 1000)
+    assert _wait_for(lambda: len(consumer.matches) == 1)
+
+    _send(publisher, a, 1000, ticket_id=ticket_a)
+    _send(publisher, d, 1000)
+    assert _wait_for(lambda: consumer.messages_processed == 3)
+    assert _wait_for(lambda: consumer.dedup.duplicates == 1)
+    assert [sorted(match) for match in consumer.matches] == [sorted([a, b])]
+    assert consumer.matchmaker.pool_size() == 1
+
+
+def test_new_ticket_after_match_is_queued(consumer):
+    consumer, publisher = consumer
+    a, b, d = (str(uuid.uuid4()) for _ in range(3))
+
+    _send(publisher, a, 1000)
+    _send(publisher, b, 1000)
+    assert _wait_for(lambda: len(consumer.matches) == 1)
+
+    _send(publisher, a, 1000)
+    _send(publisher, d, 1000)
+    assert _wait_for(lambda: len(consumer.matches) == 2)
+    assert sorted(consumer.matches[1]) == sorted([a, d])
+    assert consumer.dedup.duplicates == 0